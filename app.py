@@ -9,6 +9,8 @@ except ImportError:
 
 import streamlit as st
 import datetime
+import time
+import threading
 
 # 最初のStreamlitコマンドとしてページ設定を行う
 st.set_page_config(page_title='🦜🔗 Ask the Doc App', layout="wide")
@@ -20,18 +22,16 @@ if 'vector_store' not in st.session_state:
     st.session_state.vector_store = None
 
 from langchain_openai import OpenAI
-from langchain import hub
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
-from langchain_core.prompts import ChatPromptTemplate
 # --- LLM --- (componentsフォルダにllm.pyを配置する)---
 from components.llm import llm
 from components.llm import oai_embeddings
 # --- LLM ---
 from langchain_community.document_loaders import TextLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from src.text_splitter import JapaneseTextSplitter, decode_text
+from src.rag import answer_question
 import tempfile
 import os
+import hashlib
 import pandas as pd
 # ChromaDBとVectorStoreのインポートは後で行う (SQLite修正後)
 import io
@@ -169,28 +169,26 @@ MEDIUM_CATEGORIES = {
     ]
 }
 
-# カスタムRAGプロンプトテンプレートを定義
-# langchainhubに依存せずに自前でプロンプトを定義
-RAG_PROMPT_TEMPLATE = """あなたは不動産会社の営業担当です。取り扱っている物件を中心をしたエリアに対して、エリアの魅力や特徴、生活環境について詳しく説明することが得意です。以下の情報源を元に、質問に対して具体的で魅力的な回答を提供してください。
-
-情報源:
-{context}
-
-質問: {question}
-
-回答の際は以下のポイントを意識してください：
-1. エリアの魅力や特徴を具体的に伝える
-2. 実際に住むイメージが湧くような説明をする
-3. 交通、教育、商業施設、医療、公共施設などの生活利便性について触れる
-4. 数字やデータを用いて客観的な情報も提供する
-5. 物件の見学意欲が高まるような表現を使う
-6. 情報源に記載がない内容については「この点については情報がありません」と正直に伝える
-
-回答:"""
-
 # グローバル変数の初期化
 vector_store = None
 vector_store_available = False
+ingest_journal = None
+answer_cache = None
+
+# Streamlitは操作のたびにスクリプトを再実行するため、
+# VectorStoreと回答キャッシュはプロセス内で1つだけ作成して使い回す
+@st.cache_resource
+def _load_vector_store():
+    from src.vector_store import VectorStore
+    return VectorStore()
+
+@st.cache_resource
+def _load_answer_cache(_vector_store):
+    from src.answer_cache import SemanticAnswerCache
+    cache = SemanticAnswerCache()
+    # 元になったチャンクが削除されたらキャッシュを無効化 (内容の変更はキャッシュのキーで区別される)
+    _vector_store.add_change_listener(cache.invalidate_chunks)
+    return cache
 
 # VectorStoreのインスタンスを初期化する関数
 def initialize_vector_store():
@@ -199,8 +197,7 @@ def initialize_vector_store():
         return vector_store
         
     try:
-        from src.vector_store import VectorStore
-        vector_store = VectorStore()
+        vector_store = _load_vector_store()
         vector_store_available = True
         print("VectorStore successfully initialized")
         return vector_store
@@ -212,6 +209,46 @@ def initialize_vector_store():
 # 初期化を試みる
 initialize_vector_store()
 
+# 回答キャッシュを初期化する関数
+def initialize_answer_cache():
+    global answer_cache
+    if answer_cache is not None or vector_store is None:
+        return answer_cache
+
+    try:
+        answer_cache = _load_answer_cache(vector_store)
+        print("Answer cache successfully initialized")
+    except Exception as e:
+        answer_cache = None
+        print(f"Error initializing answer cache: {e}")
+    return answer_cache
+
+initialize_answer_cache()
+
+# 定型質問の回答を事前生成するジョブ (PREWARM_ENABLED=1 で時間帯内に自動実行)
+@st.cache_resource
+def _load_prewarm_job(_vector_store, _answer_cache):
+    from src.prewarm import PrewarmJob
+    job = PrewarmJob(_vector_store, llm, _answer_cache, MEDIUM_CATEGORIES)
+    if os.getenv("PREWARM_ENABLED") == "1":
+        job.start()
+    return job
+
+prewarm_job = None
+if vector_store is not None and answer_cache is not None:
+    try:
+        prewarm_job = _load_prewarm_job(vector_store, answer_cache)
+    except Exception as e:
+        print(f"Error initializing prewarm job: {e}")
+
+# 取り込みジャーナルを取得する関数
+def get_ingest_journal():
+    global ingest_journal
+    if ingest_journal is None:
+        from src.ingest import IngestJournal
+        ingest_journal = IngestJournal()
+    return ingest_journal
+
 def register_document(uploaded_file, additional_metadata=None):
     """
     アップロードされたファイルをChromaDBに登録する関数。
@@ -224,31 +261,20 @@ def register_document(uploaded_file, additional_metadata=None):
     if uploaded_file is not None:
         try:
             # ファイルの内容を読み込み - 複数のエンコーディングを試す
-            content = None
-            encodings_to_try = ['utf-8', 'shift_jis', 'cp932', 'euc_jp', 'iso2022_jp']
-            
             file_bytes = uploaded_file.getvalue()
-            
-            # 異なるエンコーディングを試す
-            for encoding in encodings_to_try:
-                try:
-                    content = file_bytes.decode(encoding)
-                    st.success(f"ファイルを {encoding} エンコーディングで読み込みました")
-                    break
-                except UnicodeDecodeError:
-                    continue
+            content, encoding = decode_text(file_bytes)
+            if content is not None:
+                st.success(f"ファイルを {encoding} エンコーディングで読み込みました")
             
             # どのエンコーディングでも読み込めなかった場合
             if content is None:
                 st.error("ファイルのエンコーディングを検出できませんでした。UTF-8, Shift-JIS, EUC-JP, ISO-2022-JPのいずれかで保存されたファイルをお試しください。")
                 return
             
-            # メモリ内でテキストを分割
-            text_splitter = RecursiveCharacterTextSplitter(
+            # メモリ内でテキストを分割（「。」と改行を区切りに、開始位置は1回の走査で計算）
+            text_splitter = JapaneseTextSplitter(
                 chunk_size=512,
                 chunk_overlap=10,
-                add_start_index=True,
-                separators=["\n\n", "\n", "。", ".", " ", ""],
             )
             
             # 基本メタデータの作成
@@ -283,10 +309,24 @@ def register_document(uploaded_file, additional_metadata=None):
             global vector_store
             
             # ドキュメントの追加（UPSERT）
-            vector_store.upsert_documents(documents=documents, ids=original_ids)
+            # 同じ内容のファイルを再登録すると、中断した箇所から再開される
+            job_id = f"{uploaded_file.name}:{hashlib.sha256(file_bytes).hexdigest()[:16]}"
+            report = vector_store.upsert_documents(
+                documents=documents,
+                ids=original_ids,
+                journal=get_ingest_journal(),
+                job_id=job_id
+            )
 
             st.success(f"{uploaded_file.name} をデータベースに登録しました。")
             st.info(f"{len(documents)}件のチャンクに分割されました")
+            if report and report["duplicates"]:
+                st.info(
+                    f"既存のチャンクと重複する {report['duplicates']} 件を検出しました"
+                    f"（埋め込みの生成を {report['embeddings_saved']} 件省略）"
+                )
+            if report and report["removed"]:
+                st.info(f"重複する内容で上書きされた既存のチャンク {report['removed']} 件を削除しました")
         except Exception as e:
             st.error(f"ドキュメントの登録中にエラーが発生しました: {e}")
             st.error("エラーの詳細:")
@@ -419,6 +459,130 @@ def manage_chromadb():
 
     st.markdown("---")
 
+    # コーパス分析 (DuckDB)
+    st.subheader("コーパス分析")
+    if vector_store.analytics is None:
+        st.info("DuckDBが利用できないため、コーパス分析は無効です。")
+    else:
+        analysis = st.selectbox(
+            "集計内容",
+            [
+                "市区町村 × 大カテゴリ",
+                "市区町村 × 中カテゴリ",
+                "ソース元別",
+                "登録日別",
+                "未登録の中カテゴリ（カバレッジの穴）",
+                "古いソース元（データ公開日）",
+            ]
+        )
+        stale_before = None
+        if analysis == "古いソース元（データ公開日）":
+            stale_before = st.date_input(
+                "この日付より前に公開されたデータを抽出",
+                value=datetime.date.today() - datetime.timedelta(days=365)
+            )
+
+        if st.button("集計する"):
+            try:
+                started = time.perf_counter()
+                analytics = vector_store.analytics
+                if analysis == "市区町村 × 大カテゴリ":
+                    result_df = analytics.category_matrix("major_category")
+                elif analysis == "市区町村 × 中カテゴリ":
+                    result_df = analytics.category_matrix("medium_category")
+                elif analysis == "ソース元別":
+                    result_df = analytics.counts_by(["source"])
+                elif analysis == "登録日別":
+                    result_df = analytics.counts_by(["registration_date"])
+                elif analysis == "未登録の中カテゴリ（カバレッジの穴）":
+                    result_df = analytics.coverage_gaps(MEDIUM_CATEGORIES)
+                else:
+                    result_df = analytics.stale_sources(stale_before)
+                elapsed = time.perf_counter() - started
+
+                st.dataframe(result_df)
+                st.caption(f"全 {analytics.count()} チャンクを {elapsed * 1000:.0f} ms で集計しました")
+            except Exception as e:
+                st.error(f"集計中にエラーが発生しました: {e}")
+                st.exception(e)
+
+    st.markdown("---")
+
+    # 定型質問の回答の事前生成
+    st.subheader("よくある質問の回答の事前生成")
+    if prewarm_job is None:
+        st.info("回答キャッシュが利用できないため、事前生成は無効です。")
+    else:
+        st.caption(
+            f"登録済みの市区町村 × 中カテゴリの定型質問の回答を、よく使われるフィルタ条件ごとに生成してキャッシュします"
+            f"（自動実行: {prewarm_job.window[0]}時〜{prewarm_job.window[1]}時、同時実行数 {prewarm_job.concurrency}）"
+        )
+        if prewarm_job.last_stats:
+            st.write(prewarm_job.last_stats)
+        # 質問ページのフィルタ条件の組み合わせごとのキャッシュのヒット率
+        query_stats = answer_cache.query_stats()
+        if query_stats:
+            stats_df = pd.DataFrame(query_stats)
+            stats_df["filter_keys"] = stats_df["filter_keys"].apply(lambda keys: ", ".join(keys) or "(なし)")
+            stats_df["hit_rate"] = (stats_df["hit_rate"] * 100).round(1)
+            st.caption("フィルタ条件の組み合わせごとの回答キャッシュのヒット率（事前生成はよく使われる組み合わせで行います）")
+            st.dataframe(stats_df.rename(columns={
+                "filter_keys": "フィルタ項目",
+                "lookups": "質問数",
+                "hits": "ヒット数",
+                "prewarmed_hits": "事前生成へのヒット数",
+                "hit_rate": "ヒット率(%)",
+            }))
+        if st.button("今すぐ事前生成する"):
+            if prewarm_job.run_lock.locked():
+                st.info("事前生成はすでに実行中です。")
+            else:
+                threading.Thread(target=prewarm_job.run_once, name="prewarm-manual", daemon=True).start()
+                st.success("バックグラウンドで事前生成を開始しました。")
+
+    st.markdown("---")
+
+    # スナップショットの書き出し・復元
+    st.subheader("スナップショットの書き出し・復元")
+    st.caption("埋め込みベクトルごと保存するため、復元時に埋め込みAPIを呼び出しません。")
+
+    snapshot_format = st.radio("形式", ["parquet", "arrow"], horizontal=True)
+    if st.button("スナップショットを作成"):
+        with st.spinner('書き出し中...'):
+            try:
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    snapshot_path = os.path.join(tmp_dir, f"snapshot.{snapshot_format}")
+                    exported = vector_store.export_snapshot(snapshot_path)
+                    if exported:
+                        with open(snapshot_path, "rb") as f:
+                            st.download_button(
+                                "スナップショットをダウンロード",
+                                data=f.read(),
+                                file_name=f"{datetime.date.today()}_snapshot.{snapshot_format}"
+                            )
+                        st.success(f"{exported} 件のドキュメントを書き出しました")
+                    else:
+                        st.info("書き出すデータがありません。")
+            except Exception as e:
+                st.error(f"スナップショットの作成中にエラーが発生しました: {e}")
+                st.exception(e)
+
+    snapshot_file = st.file_uploader('スナップショットから復元', type=['parquet', 'arrow', 'feather'])
+    if snapshot_file and st.button("復元する"):
+        with st.spinner('復元中...'):
+            try:
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    snapshot_path = os.path.join(tmp_dir, snapshot_file.name)
+                    with open(snapshot_path, "wb") as f:
+                        f.write(snapshot_file.getvalue())
+                    restored = vector_store.restore_snapshot(snapshot_path)
+                st.success(f"{restored} 件のドキュメントを復元しました")
+            except Exception as e:
+                st.error(f"スナップショットの復元中にエラーが発生しました: {e}")
+                st.exception(e)
+
+    st.markdown("---")
+
     # 3.全データ削除
     st.subheader("ChromaDB 登録データ全削除")
     if st.button("全データを削除する"):
@@ -450,46 +614,23 @@ def generate_response(query_text, filter_conditions=None):
             # グローバルのVectorStoreインスタンスを使用
             global vector_store
 
-            # カスタムプロンプトテンプレートを作成
-            try:
-                # まずhub.pullを試す（langchainhubがインストールされている場合）
-                prompt = hub.pull("rlm/rag-prompt")
-                print("Successfully pulled prompt from langchain hub")
-            except (ImportError, Exception) as e:
-                # 失敗した場合は自前のプロンプトを使用
-                print(f"Using custom prompt template due to: {e}")
-                prompt = ChatPromptTemplate.from_template(RAG_PROMPT_TEMPLATE)
-
-            def format_docs(docs):
-                return "\n\n".join(doc.page_content for doc in docs)
-
-            # 検索結果を取得（フィルタリング条件があれば適用）
-            search_results = vector_store.search(query_text, n_results=5, filter_conditions=filter_conditions)
-            
+            # 検索・キャッシュの確認・回答生成
+            result = answer_question(
+                vector_store,
+                llm,
+                query_text,
+                filter_conditions=filter_conditions,
+                answer_cache=answer_cache
+            )
+
             # 検索結果がない場合
-            if not search_results or not search_results.get('documents', [[]])[0]:
+            if not result["docs"]:
                 return "申し訳ありません。指定された条件に一致するドキュメントが見つかりませんでした。検索条件を変更してお試しください。"
-            
-            # 検索結果をドキュメント形式に変換
-            from langchain_core.documents import Document
-            docs = []
-            for i, doc_text in enumerate(search_results['documents'][0]):
-                # メタデータの取得（利用可能な場合）
-                metadata = {}
-                if search_results.get('metadatas') and len(search_results['metadatas']) > 0:
-                    metadata = search_results['metadatas'][0][i] if i < len(search_results['metadatas'][0]) else {}
-                
-                # ドキュメントの作成
-                doc = Document(
-                    page_content=doc_text,
-                    metadata=metadata
-                )
-                docs.append(doc)
 
             # 使用するメタデータの情報を表示
             st.markdown("#### 検索結果")
             meta_info = []
-            for i, doc in enumerate(docs):
+            for i, doc in enumerate(result["docs"]):
                 meta_str = ""
                 if doc.metadata.get('municipality'):
                     meta_str += f"【市区町村】{doc.metadata['municipality']} "
@@ -504,16 +645,9 @@ def generate_response(query_text, filter_conditions=None):
             
             st.markdown("\n".join(meta_info))
 
-            qa_chain = (
-                {
-                    "context": lambda x: format_docs(docs),
-                    "question": RunnablePassthrough(),
-                }
-                | prompt
-                | llm
-                | StrOutputParser()
-            )
-            return qa_chain.invoke(query_text)
+            if result["cached"]:
+                st.caption("類似した質問の回答をキャッシュから表示しています")
+            return result["answer"]
         except Exception as e:
             st.error(f"質問の処理中にエラーが発生しました: {e}")
             st.error("エラーの詳細:")
@@ -532,6 +666,24 @@ def ask_question():
         st.info("ローカル環境での実行をお試しください。")
         return
 
+    # 事前生成した回答がある定型質問は、同じ文面・同じ条件で送るとキャッシュから回答できる
+    faq = answer_cache.prewarmed_questions() if answer_cache is not None else []
+    if faq:
+        with st.expander("よくある質問", expanded=False):
+            def faq_label(item):
+                question, conditions = item
+                return f"{question}（{'、'.join(conditions.values()) or '絞り込みなし'}）"
+
+            faq_item = st.selectbox("質問を選択", faq, format_func=faq_label)
+            if st.button("この質問の回答を見る"):
+                with st.spinner('回答を生成中...'):
+                    response = generate_response(*faq_item)
+                    if response:
+                        st.success("回答:")
+                        st.info(response)
+                    else:
+                        st.error("回答の生成に失敗しました。")
+
     # フィルタリング条件の設定
     with st.expander("検索範囲の絞り込み", expanded=False):
         col1, col2 = st.columns(2)
@@ -0,0 +1,78 @@
+"""
+スナップショットからの復元 (ウォームスタート) にかかる時間のベンチマーク
+
+ランダムな埋め込みを持つチャンクでコレクションを作ってスナップショットに書き出し、
+空のVectorStoreに restore_snapshot で復元する時間を測る。埋め込みAPIは呼び出さない。
+
+実行方法 (リポジトリのルートで):
+    python -m benchmarks.bench_snapshot_restore --rows 20000 --dim 1536 --format arrow --dedup off
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from src.vector_store import SNAPSHOT_BATCH_SIZE, VectorStore
+
+MUNICIPALITIES = ["川崎市", "横浜市", "世田谷区", "町田市", "相模原市"]
+SENTENCE = "駅から徒歩{}分の範囲にスーパーや公園があり、子育て世帯にも住みやすい地域です。"
+
+
+def make_rows(n, dim, seed=0):
+    """チャンクのテキスト・メタデータ・埋め込みを生成"""
+    rng = random.Random(seed)
+    vectors = np.random.default_rng(seed).standard_normal((n, dim), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    ids = [f"bench_{i:08}" for i in range(n)]
+    texts = ["".join(SENTENCE.format(rng.randint(1, 10**6)) for _ in range(8)) for _ in range(n)]
+    metadatas = [{"municipality": rng.choice(MUNICIPALITIES), "source": f"bench_{i // 50}.txt"} for i in range(n)]
+    return ids, texts, metadatas, vectors
+
+
+def build_snapshot(path, n, dim):
+    """チャンクを直接コレクションに書き込み、スナップショットに書き出す"""
+    store = VectorStore(dedup_policy="off")
+    ids, texts, metadatas, vectors = make_rows(n, dim)
+    for start in range(0, n, SNAPSHOT_BATCH_SIZE):
+        end = start + SNAPSHOT_BATCH_SIZE
+        store.collection.add(
+            ids=ids[start:end],
+            documents=texts[start:end],
+            metadatas=metadatas[start:end],
+            embeddings=vectors[start:end].tolist()
+        )
+    store.export_snapshot(path)
+    # インメモリのクライアントはプロセス内で共有されるため、復元前に空にする
+    store.client.reset()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000, help="チャンク数")
+    parser.add_argument("--dim", type=int, default=1536, help="埋め込みの次元数")
+    parser.add_argument("--format", choices=["arrow", "parquet"], default="arrow")
+    parser.add_argument("--dedup", default="off", help="復元先のVectorStoreの重複チャンクの扱い")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, f"snapshot.{args.format}")
+        build_snapshot(path, args.rows, args.dim)
+        size_mb = os.path.getsize(path) / 1e6
+
+        started = time.perf_counter()
+        store = VectorStore(dedup_policy=args.dedup)
+        init_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        restored = store.restore_snapshot(path)
+        restore_seconds = time.perf_counter() - started
+
+    print(f"\n{restored} rows x {args.dim} dims, {args.format} {size_mb:.0f}MB, dedup={args.dedup}")
+    print(f"init    {init_seconds:8.2f}s")
+    print(f"restore {restore_seconds:8.2f}s  ({restored / restore_seconds:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+テキスト分割のスループットを比較するベンチマーク
+
+実行方法 (リポジトリのルートで):
+    python -m benchmarks.bench_text_splitter --size-mb 5 --files 8
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from src.text_splitter import JapaneseTextSplitter, split_files
+
+SENTENCES = [
+    "最寄り駅は東急田園都市線のたまプラーザ駅で、徒歩8分です。",
+    "駅周辺にはスーパーやドラッグストアが集まっており、日常の買い物に便利です。",
+    "市内には公立小学校が23校、中学校が12校あります。",
+    "ハザードマップでは、洪水時の浸水想定区域に含まれていません。",
+    "平日朝の通勤時間帯は、渋谷駅まで約30分で到着します。",
+    "地域の夏祭りは毎年8月に開催され、多くの家族連れでにぎわいます。",
+]
+
+
+def make_text(n_chars, seed=0):
+    """ベンチマーク用の日本語テキストを生成"""
+    rng = random.Random(seed)
+    parts = []
+    total = 0
+    while total < n_chars:
+        if rng.random() < 0.15:
+            part = "\n\n" if rng.random() < 0.3 else "\n"
+        else:
+            part = rng.choice(SENTENCES)
+        parts.append(part)
+        total += len(part)
+    return "".join(parts)
+
+
+def measure(label, fn, n_chars):
+    started = time.perf_counter()
+    n_chunks = fn()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<40} {elapsed:8.3f}s {n_chars / elapsed / 1e6:8.2f} Mchars/s {n_chunks:>8} chunks")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=2.0, help="1ファイルあたりの文字数 (百万文字)")
+    parser.add_argument("--files", type=int, default=4, help="並列分割に使うファイル数")
+    parser.add_argument("--workers", type=int, default=None, help="ワーカープロセス数")
+    args = parser.parse_args()
+
+    n_chars = int(args.size_mb * 1e6)
+    text = make_text(n_chars)
+    document = Document(page_content=text, metadata={"source": "bench.txt"})
+
+    recursive = RecursiveCharacterTextSplitter(
+        chunk_size=512,
+        chunk_overlap=10,
+        add_start_index=True,
+        separators=["\n\n", "\n", "。", ".", " ", ""],
+    )
+    japanese = JapaneseTextSplitter(chunk_size=512, chunk_overlap=10)
+
+    print(f"Single document: {len(text):,} chars")
+    baseline = measure(
+        "RecursiveCharacterTextSplitter",
+        lambda: len(recursive.split_documents([document])),
+        len(text)
+    )
+    single = measure(
+        "JapaneseTextSplitter",
+        lambda: len(japanese.split_documents([document])),
+        len(text)
+    )
+    print(f"Speedup: {baseline / single:.1f}x")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = []
+        for i in range(args.files):
+            path = os.path.join(tmp_dir, f"bench_{i}.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(make_text(n_chars, seed=i))
+            paths.append(path)
+
+        total_chars = n_chars * args.files
+        print(f"\n{args.files} files: {total_chars:,} chars")
+        measure(
+            "JapaneseTextSplitter (sequential)",
+            lambda: sum(len(japanese.split_text(open(p, encoding="utf-8").read())) for p in paths),
+            total_chars
+        )
+        measure(
+            "JapaneseTextSplitter (process pool)",
+            lambda: sum(len(chunks) for chunks in split_files(paths, max_workers=args.workers).values()),
+            total_chars
+        )
+
+
+if __name__ == "__main__":
+    main()
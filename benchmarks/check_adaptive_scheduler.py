@@ -0,0 +1,158 @@
+"""
+AdaptiveBatchScheduler と取り込みジャーナルの動作確認
+
+ローカルのフェイク埋め込みサーバー (benchmarks/fake_openai.py) に429を注入し、次を確認する。
+  - 429を受けるとトークン予算が半分になり、Retry-Afterの秒数だけ待つ
+  - 成功が続くとトークン予算が増える
+  - すべてのテキストがちょうど1回、元の順序どおりに埋め込まれる
+  - 取り込みが途中で失敗しても、同じジョブを再実行すると未完了のチャンクだけが埋め込まれる
+
+実行方法 (リポジトリのルートで):
+    python -m benchmarks.check_adaptive_scheduler
+"""
+import os
+import random
+import sys
+import tempfile
+
+import httpx
+
+from benchmarks.fake_openai import FakeOpenAIConfig, FakeOpenAIServer, fake_embedding
+from src.ingest import AdaptiveBatchScheduler, IngestJournal
+
+EMBEDDING_DIM = 8
+failures = []
+
+
+def check(condition, message):
+    print(f"{'ok    ' if condition else 'FAILED'} {message}")
+    if not condition:
+        failures.append(message)
+
+
+class HttpEmbeddings:
+    """フェイクサーバーの /embeddings を呼び出す最小限のクライアント (クライアント側では再試行しない)"""
+
+    def __init__(self, base_url):
+        self.client = httpx.Client(base_url=base_url, timeout=30)
+        self.requests = []
+
+    def embed_documents(self, texts):
+        self.requests.append(len(texts))
+        response = self.client.post("/embeddings", json={"input": texts, "dimensions": EMBEDDING_DIM})
+        # 429の場合は response (status_code と retry-after ヘッダー) を持つ例外になる
+        response.raise_for_status()
+        return [item["embedding"] for item in response.json()["data"]]
+
+
+def make_texts(n, length=100):
+    return [f"{i:05}" + "駅から徒歩圏内に商業施設や公園がそろった住みやすい地域です。" * (length // 30) for i in range(n)]
+
+
+def check_throttling(server):
+    print("\n[scheduler] 429 injection")
+    texts = make_texts(300)
+    embeddings = HttpEmbeddings(server.base_url)
+    request_budgets = []
+    sleeps = []
+
+    scheduler = AdaptiveBatchScheduler(
+        initial_tokens=2000,
+        min_tokens=200,
+        increase_tokens=500,
+        max_retries=50,
+        # 実際には待たずに、待ち時間とその時点のトークン予算を記録する
+        sleep=lambda delay: sleeps.append((delay, scheduler.token_budget)),
+    )
+    # 文字数で見積もる (tiktokenの有無で結果が変わらないようにする)
+    scheduler.estimate_tokens = len
+
+    def embed_fn(batch):
+        request_budgets.append(scheduler.token_budget)
+        return embeddings.embed_documents(batch)
+
+    results = []
+
+    def on_batch(start, end, batch_embeddings):
+        if start != len(results):
+            check(False, f"batch [{start}, {end}) follows the previous one")
+        results.extend(batch_embeddings)
+
+    scheduler.run(texts, embed_fn, on_batch)
+    stats = server.stats
+
+    check(stats["rate_limited"] > 0, f"server injected {stats['rate_limited']} rate limits")
+    check(len(sleeps) == stats["rate_limited"], f"scheduler waited once per 429 ({len(sleeps)} waits)")
+    check(all(delay == 1.0 for delay, _ in sleeps), "every wait honoured Retry-After: 1")
+    # 予算が減ったのは429の直後だけで、そのたびに半分 (下限あり) になっている
+    throttled_requests = [
+        (before, after) for before, after in zip(request_budgets, request_budgets[1:]) if after < before
+    ]
+    halved = all(after == max(200, before // 2) for before, after in throttled_requests)
+    check(bool(throttled_requests) and halved, f"token budget halved after 429 ({len(throttled_requests)} times)")
+    grew = any(after > before for before, after in zip(request_budgets, request_budgets[1:]))
+    check(grew, f"token budget grew after successes (max {max(request_budgets)})")
+    check(
+        len(results) == len(texts)
+        and all(result == fake_embedding(text, EMBEDDING_DIM) for text, result in zip(texts, results)),
+        "every text embedded exactly once, in order"
+    )
+
+
+def check_resume(server):
+    print("\n[journal] resume after an interrupted ingest")
+    from src.vector_store import VectorStore
+
+    texts = make_texts(120)
+    ids = [f"resume_{i:08}" for i in range(len(texts))]
+    embeddings = HttpEmbeddings(server.base_url)
+
+    store = VectorStore(dedup_policy="off")
+    store.client.reset()
+    store = VectorStore(dedup_policy="off")
+    store.scheduler = AdaptiveBatchScheduler(initial_tokens=1500, increase_tokens=0, sleep=lambda delay: None)
+    store.scheduler.estimate_tokens = len
+
+    # 3バッチ書き込んだところで取り込みが中断したことにする
+    def interrupted(batch):
+        if len(embeddings.requests) >= 3:
+            raise RuntimeError("simulated crash")
+        return embeddings.embed_documents(batch)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        journal = IngestJournal(os.path.join(tmp_dir, "ingest_journal.db"))
+        store.batch_embeddings = type("Interrupted", (), {"embed_documents": staticmethod(interrupted)})()
+        try:
+            store.upsert_documents(texts, ids=ids, journal=journal, job_id="resume-check")
+            check(False, "first run was interrupted")
+        except RuntimeError:
+            pass
+        written = sum(embeddings.requests)
+        check(len(journal.completed("resume-check")) == written, f"journal recorded {written} written chunks")
+        check(store.count() == written, "collection holds exactly the journaled chunks")
+
+        embeddings.requests.clear()
+        store.batch_embeddings = embeddings
+        store.upsert_documents(texts, ids=ids, journal=journal, job_id="resume-check")
+        check(sum(embeddings.requests) == len(texts) - written, f"re-run embedded only the {len(texts) - written} remaining chunks")
+        check(store.count() == len(texts), "collection holds every chunk after the re-run")
+        check(journal.completed("resume-check") == {}, "finished job was removed from the journal")
+        journal.close()
+
+
+def main():
+    random.seed(0)
+    config = FakeOpenAIConfig(embed_latency_ms=2, embed_ms_per_input=0, rate_limit_rate=0.3, jitter=0, embedding_dim=EMBEDDING_DIM)
+    with FakeOpenAIServer(config) as server:
+        check_throttling(server)
+    with FakeOpenAIServer(FakeOpenAIConfig(embed_latency_ms=2, embed_ms_per_input=0, jitter=0)) as server:
+        check_resume(server)
+
+    if failures:
+        print(f"\n{len(failures)} check(s) failed")
+        sys.exit(1)
+    print("\nAll checks passed")
+
+
+if __name__ == "__main__":
+    main()
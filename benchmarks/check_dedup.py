@@ -0,0 +1,116 @@
+"""
+取り込み時の重複検出 (DEDUP_POLICY) の動作確認
+
+埋め込みAPIの代わりにテキストから決定的に作るベクトルを使い、次を確認する。
+  - skip: 既存のIDが別のチャンクと重複する内容で上書きされると、古い内容がコレクション・集計テーブル・
+    重複検出のインデックスから削除される
+  - link: 同じ場合に、IDは新しい内容と duplicate_of で登録し直される
+  - 埋め込みの途中で失敗した取り込みのチャンクは、インデックスに残らない (後の取り込みで重複扱いにならない)
+
+実行方法 (リポジトリのルートで):
+    python -m benchmarks.check_dedup
+"""
+import sys
+import zlib
+
+import numpy as np
+
+from src.vector_store import VectorStore
+
+EMBEDDING_DIM = 8
+failures = []
+
+BASE_TEXT = "駅から徒歩5分の場所に図書館と公園があり、週末は家族連れでにぎわう住みやすい地域です。"
+OTHER_TEXT = "市役所の窓口は平日の8時30分から17時15分まで開いており、住民票の写しは郵送でも請求できます。"
+
+
+def check(condition, message):
+    print(f"{'ok    ' if condition else 'FAILED'} {message}")
+    if not condition:
+        failures.append(message)
+
+
+class FakeEmbeddings:
+    """テキストから決定的にベクトルを作る埋め込み (fail_after 回を超えた呼び出しは失敗する)"""
+
+    def __init__(self, fail_after=None):
+        self.fail_after = fail_after
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        if self.fail_after is not None and self.calls > self.fail_after:
+            raise RuntimeError("simulated embedding failure")
+        return [
+            np.random.default_rng(zlib.crc32(text.encode("utf-8"))).random(EMBEDDING_DIM).tolist()
+            for text in texts
+        ]
+
+
+def new_store(policy):
+    store = VectorStore(dedup_policy="off")
+    store.client.reset()
+    store = VectorStore(dedup_policy=policy)
+    store.batch_embeddings = FakeEmbeddings()
+    return store
+
+
+def check_skip_overwrite():
+    print("\n[skip] existing ID overwritten with a near-duplicate")
+    store = new_store("skip")
+    store.upsert_documents([BASE_TEXT, OTHER_TEXT], ids=["base", "other"])
+
+    # "other" を "base" とほぼ同じ内容で上書きする
+    report = store.upsert_documents([BASE_TEXT + "。"], ids=["other"])
+    check(report["skipped"] == 1 and report.get("removed") == 1, f"report: {report}")
+    check(store.collection.get(ids=["other"])["ids"] == [], "old content removed from the collection")
+    if store.analytics is not None:
+        check(store.analytics.count() == 1, "old content removed from the analytics table")
+    check("other" not in store.deduplicator.index.signatures, "old signature removed from the dedup index")
+
+    # 古い内容と同じテキストを別のIDで登録しても重複扱いにならない
+    report = store.upsert_documents([OTHER_TEXT], ids=["other_again"])
+    check(report["duplicates"] == 0, "old content is no longer matched as a duplicate")
+
+
+def check_link_overwrite():
+    print("\n[link] existing ID overwritten with a near-duplicate")
+    store = new_store("link")
+    store.upsert_documents([BASE_TEXT, OTHER_TEXT], ids=["base", "other"])
+
+    report = store.upsert_documents([BASE_TEXT + "。"], ids=["other"])
+    stored = store.collection.get(ids=["other"], include=["documents", "metadatas"])
+    check(report["linked"] == 1, f"report: {report}")
+    check(stored["documents"] == [BASE_TEXT + "。"], "ID holds the new content")
+    check(stored["metadatas"][0].get("duplicate_of") == "base", "ID is linked to its canonical chunk")
+
+
+def check_failed_ingest():
+    print("\n[skip] failed ingest leaves nothing in the dedup index")
+    store = new_store("skip")
+    store.batch_embeddings = FakeEmbeddings(fail_after=0)
+    try:
+        store.upsert_documents([BASE_TEXT], ids=["lost"])
+        check(False, "ingest failed")
+    except RuntimeError:
+        pass
+    check(len(store.deduplicator.index) == 0, "no signature indexed for the unwritten chunk")
+
+    store.batch_embeddings = FakeEmbeddings()
+    report = store.upsert_documents([BASE_TEXT + "。"], ids=["retry"])
+    check(report["duplicates"] == 0 and store.count() == 1, "retried content is stored, not skipped")
+
+
+def main():
+    check_skip_overwrite()
+    check_link_overwrite()
+    check_failed_ingest()
+
+    if failures:
+        print(f"\n{len(failures)} check(s) failed")
+        sys.exit(1)
+    print("\nAll checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+負荷試験用のOpenAI互換サーバー (チャットと埋め込み)
+
+実際のAPIを呼ばずに、レイテンシ・スループット・エラー率を指定して応答を返す。
+アプリをこのサーバーに向けて起動することもできる:
+    python -m benchmarks.fake_openai --port 8001 --chat-latency-ms 800
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=fake streamlit run app.py
+"""
+import argparse
+import asyncio
+import random
+import threading
+import time
+import uuid
+import zlib
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+# 応答の既定値
+DEFAULT_EMBEDDING_DIM = 1536
+FAKE_ANSWER = "この地域は駅から徒歩圏内に商業施設や公園がそろい、子育て世帯にも住みやすいエリアです。"
+
+
+class FakeOpenAIConfig:
+    """
+    フェイクサーバーの振る舞いの設定
+
+    引数:
+        chat_latency_ms: チャットの最初のトークンまでの待ち時間
+        chat_tokens_per_second: チャットの生成速度 (completion_tokens をこの速度で生成したものとして待つ)
+        completion_tokens: チャットの応答トークン数
+        embed_latency_ms: 埋め込み1リクエストあたりの待ち時間
+        embed_ms_per_input: 埋め込みの入力1件あたりの追加の待ち時間
+        max_concurrency: 同時に処理するリクエスト数 (超えた分は待たされる)
+        error_rate: 500を返す確率
+        rate_limit_rate: 429を返す確率
+        jitter: 待ち時間の揺らぎ (割合)
+        embedding_dim: 埋め込みの次元数
+    """
+
+    def __init__(
+        self,
+        chat_latency_ms=500.0,
+        chat_tokens_per_second=100.0,
+        completion_tokens=200,
+        embed_latency_ms=50.0,
+        embed_ms_per_input=0.5,
+        max_concurrency=64,
+        error_rate=0.0,
+        rate_limit_rate=0.0,
+        jitter=0.2,
+        embedding_dim=DEFAULT_EMBEDDING_DIM,
+    ):
+        self.chat_latency_ms = chat_latency_ms
+        self.chat_tokens_per_second = chat_tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.embed_latency_ms = embed_latency_ms
+        self.embed_ms_per_input = embed_ms_per_input
+        self.max_concurrency = max_concurrency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.jitter = jitter
+        self.embedding_dim = embedding_dim
+
+
+def fake_embedding(value, dim=DEFAULT_EMBEDDING_DIM):
+    """入力から決まる正規化済みの埋め込み (同じ入力には常に同じベクトルを返す)"""
+    rng = np.random.default_rng(zlib.crc32(repr(value).encode("utf-8")))
+    vector = rng.standard_normal(dim).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def _error(status, message, headers=None):
+    return JSONResponse(
+        status_code=status,
+        content={"error": {"message": message, "type": "fake_error", "code": status}},
+        headers=headers,
+    )
+
+
+def create_app(config=None):
+    """フェイクサーバーのFastAPIアプリを作成"""
+    config = config or FakeOpenAIConfig()
+    app = FastAPI(title="Fake OpenAI")
+    app.state.config = config
+    app.state.stats = {"chat": 0, "embeddings": 0, "errors": 0, "rate_limited": 0}
+    semaphore = asyncio.Semaphore(config.max_concurrency)
+
+    async def wait(ms):
+        jitter = 1.0 + random.uniform(-config.jitter, config.jitter)
+        await asyncio.sleep(max(0.0, ms * jitter) / 1000)
+
+    def injected_error():
+        roll = random.random()
+        if roll < config.rate_limit_rate:
+            app.state.stats["rate_limited"] += 1
+            return _error(429, "Rate limit reached (fake)", headers={"retry-after": "1"})
+        if roll < config.rate_limit_rate + config.error_rate:
+            app.state.stats["errors"] += 1
+            return _error(500, "Internal server error (fake)")
+        return None
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "gpt-4o-mini", "object": "model"}]}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        error = injected_error()
+        if error is not None:
+            return error
+        async with semaphore:
+            generation_ms = config.completion_tokens / config.chat_tokens_per_second * 1000
+            await wait(config.chat_latency_ms + generation_ms)
+        app.state.stats["chat"] += 1
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages", []))
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o-mini"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": FAKE_ANSWER},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": config.completion_tokens,
+                "total_tokens": prompt_tokens + config.completion_tokens,
+            },
+        }
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        error = injected_error()
+        if error is not None:
+            return error
+        inputs = body.get("input", [])
+        # 文字列1件、文字列のリスト、トークンIDのリスト (のリスト) のいずれも受け付ける
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        async with semaphore:
+            await wait(config.embed_latency_ms + config.embed_ms_per_input * len(inputs))
+        app.state.stats["embeddings"] += 1
+        dim = body.get("dimensions") or config.embedding_dim
+        return {
+            "object": "list",
+            "data": [
+                {"object": "embedding", "index": i, "embedding": fake_embedding(value, dim)}
+                for i, value in enumerate(inputs)
+            ],
+            "model": body.get("model", "text-embedding-3-small"),
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        }
+
+    return app
+
+
+class FakeOpenAIServer:
+    """フェイクサーバーをバックグラウンドスレッドで起動・停止する"""
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.app = create_app(config)
+        self.server = uvicorn.Server(uvicorn.Config(self.app, host=host, port=port, log_level="warning"))
+        self.thread = None
+
+    @property
+    def base_url(self):
+        sock = self.server.servers[0].sockets[0]
+        host, port = sock.getsockname()[:2]
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def stats(self):
+        return dict(self.app.state.stats)
+
+    def start(self, timeout=10.0):
+        self.thread = threading.Thread(target=self.server.run, name="fake-openai", daemon=True)
+        self.thread.start()
+        deadline = time.time() + timeout
+        while not self.server.started:
+            if time.time() > deadline or not self.thread.is_alive():
+                raise RuntimeError("Fake OpenAI server failed to start")
+            time.sleep(0.05)
+        print(f"Fake OpenAI server listening on {self.base_url}")
+        return self
+
+    def stop(self):
+        self.server.should_exit = True
+        if self.thread is not None:
+            self.thread.join(timeout=10)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--chat-latency-ms", type=float, default=500.0)
+    parser.add_argument("--chat-tokens-per-second", type=float, default=100.0)
+    parser.add_argument("--embed-latency-ms", type=float, default=50.0)
+    parser.add_argument("--max-concurrency", type=int, default=64)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    config = FakeOpenAIConfig(
+        chat_latency_ms=args.chat_latency_ms,
+        chat_tokens_per_second=args.chat_tokens_per_second,
+        embed_latency_ms=args.embed_latency_ms,
+        max_concurrency=args.max_concurrency,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="info")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+HNSWパラメータのrecall/レイテンシ/インデックスサイズのトレードオフを測定するツール
+
+スナップショット (VectorStore.export_snapshot で作成) から埋め込みをサンプリングし、
+総当たりで求めた正解の近傍と比較して recall@k を計算する。
+ChromaDBが内部で使っているhnswlibのインデックスを直接構築して測定するため、
+search_ef はインデックスを作り直さずに切り替えられる。
+
+実行方法 (リポジトリのルートで):
+    python -m benchmarks.hnsw_tuner corpus.parquet --sample 20000 --queries 200 --k 5 --target-recall 0.95
+"""
+import argparse
+import itertools
+import os
+import tempfile
+import time
+
+import numpy as np
+
+M_VALUES = [8, 16, 32, 48]
+CONSTRUCTION_EF_VALUES = [64, 100, 200, 400]
+SEARCH_EF_VALUES = [10, 20, 50, 100, 200, 400]
+
+
+def load_snapshot_vectors(path, limit=None):
+    """スナップショットファイルから埋め込みを読み込む"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    source = pa.memory_map(path, "r")
+    if path.endswith((".arrow", ".feather")):
+        table = pa.ipc.open_file(source).read_all().select(["embedding"])
+    else:
+        table = pq.read_table(source, columns=["embedding"])
+    if limit is not None:
+        table = table.slice(0, limit)
+    column = table.column("embedding").combine_chunks()
+    dim = column.type.list_size
+    return column.flatten().to_numpy(zero_copy_only=False).reshape(-1, dim).astype(np.float32)
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def ground_truth(data, queries, k):
+    """コサイン類似度の総当たりで各クエリの正解k近傍を求める"""
+    similarities = _normalize(queries) @ _normalize(data).T
+    top = np.argpartition(-similarities, kth=min(k, data.shape[0] - 1), axis=1)[:, :k]
+    order = np.take_along_axis(similarities, top, axis=1).argsort(axis=1)[:, ::-1]
+    return np.take_along_axis(top, order, axis=1)
+
+
+def index_size_bytes(index):
+    """hnswlibのインデックスを一時ファイルに保存して実際のサイズを測る (ベクトルとリンクを含む)"""
+    fd, path = tempfile.mkstemp(suffix=".bin")
+    os.close(fd)
+    try:
+        index.save_index(path)
+        return os.path.getsize(path)
+    finally:
+        os.remove(path)
+
+
+def evaluate(data, queries, truth, M, construction_ef, search_ef_values, k, num_threads=1):
+    """
+    1つのインデックスを構築し、search_efごとの recall@k とレイテンシを測定
+
+    戻り値:
+        search_efごとの測定結果の辞書のリスト
+    """
+    import hnswlib
+
+    n, dim = data.shape
+    index = hnswlib.Index(space="cosine", dim=dim)
+    index.init_index(max_elements=n, ef_construction=construction_ef, M=M)
+    index.set_num_threads(num_threads)
+    started = time.perf_counter()
+    index.add_items(data, np.arange(n))
+    build_seconds = time.perf_counter() - started
+    index_bytes = index_size_bytes(index)
+
+    rows = []
+    for search_ef in search_ef_values:
+        index.set_ef(max(search_ef, k))
+        latencies = []
+        hits = 0
+        # 実運用と同じく1クエリずつ検索してレイテンシを測る
+        for query, expected in zip(queries, truth):
+            started = time.perf_counter()
+            labels, _ = index.knn_query(query, k=k)
+            latencies.append(time.perf_counter() - started)
+            hits += len(set(labels[0]) & set(expected))
+        rows.append({
+            "M": M,
+            "construction_ef": construction_ef,
+            "search_ef": search_ef,
+            "recall": hits / (len(queries) * k),
+            "p50_ms": float(np.percentile(latencies, 50) * 1000),
+            "p95_ms": float(np.percentile(latencies, 95) * 1000),
+            "build_s": build_seconds,
+            "index_mb": index_bytes / 1e6,
+        })
+    return rows
+
+
+def sweep(
+    vectors,
+    n_queries=200,
+    k=5,
+    m_values=M_VALUES,
+    construction_ef_values=CONSTRUCTION_EF_VALUES,
+    search_ef_values=SEARCH_EF_VALUES,
+    seed=0,
+):
+    """
+    パラメータの組み合わせを総当たりで測定
+
+    引数:
+        vectors: 埋め込みの配列 (一部をクエリとして取り出し、残りでインデックスを作る)
+        n_queries: クエリ数
+        k: recall@k の k
+    """
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(vectors))
+    queries = vectors[order[:n_queries]]
+    data = vectors[order[n_queries:]]
+    truth = ground_truth(data, queries, k)
+
+    results = []
+    for M, construction_ef in itertools.product(m_values, construction_ef_values):
+        rows = evaluate(data, queries, truth, M, construction_ef, search_ef_values, k)
+        for row in rows:
+            print(
+                f"M={row['M']:<3} construction_ef={row['construction_ef']:<4} search_ef={row['search_ef']:<4} "
+                f"recall@{k}={row['recall']:.4f} p95={row['p95_ms']:.3f}ms index={row['index_mb']:.1f}MB"
+            )
+        results.extend(rows)
+    return results
+
+
+def recommend(results, target_recall):
+    """目標recallを満たす中で、p95レイテンシ・インデックスサイズ・構築時間が最も小さい設定を選ぶ"""
+    candidates = [r for r in results if r["recall"] >= target_recall]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda r: (r["p95_ms"], r["index_mb"], r["build_s"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("snapshot", help="VectorStore.export_snapshot で作成したファイル")
+    parser.add_argument("--sample", type=int, default=20000, help="使用する埋め込みの最大数")
+    parser.add_argument("--queries", type=int, default=200, help="クエリとして使う埋め込みの数")
+    parser.add_argument("--k", type=int, default=5, help="recall@k の k (検索時の n_results)")
+    parser.add_argument("--target-recall", type=float, default=0.95, help="目標とするrecall")
+    args = parser.parse_args()
+
+    vectors = load_snapshot_vectors(args.snapshot, limit=args.sample)
+    print(f"Loaded {len(vectors)} vectors of dimension {vectors.shape[1]}")
+    results = sweep(vectors, n_queries=args.queries, k=args.k)
+
+    best = recommend(results, args.target_recall)
+    if best is None:
+        top = max(results, key=lambda r: r["recall"])
+        print(f"\nNo setting reached recall@{args.k} >= {args.target_recall} (best: {top['recall']:.4f})")
+        return
+    print(f"\nRecommended settings for recall@{args.k} >= {args.target_recall}:")
+    print(f"  recall@{args.k}={best['recall']:.4f} p95={best['p95_ms']:.3f}ms index={best['index_mb']:.1f}MB")
+    print(f"  HNSW_M={best['M']}")
+    print(f"  HNSW_CONSTRUCTION_EF={best['construction_ef']}")
+    print(f"  HNSW_SEARCH_EF={best['search_ef']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""
+フェイクのOpenAI互換サーバーを使ったエンドツーエンドの負荷試験
+
+ローカルにフェイクサーバーを起動し、components/llm.py と VectorStore をそのサーバーに向けて、
+登録 (ingest) と質問 (ask) を混ぜた同時アクセスを発生させる。
+段階ごとのスループット・レイテンシのパーセンタイル・エラー率を出力する。
+再試行はクライアント側で隠れないよう既定では行わず (--retries で指定)、設定は結果に含める。
+
+実行方法 (リポジトリのルートで):
+    python -m benchmarks.loadtest --users 8 --duration 30 --ask-ratio 0.8 --chat-latency-ms 800 --json report.json
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from benchmarks.fake_openai import FakeOpenAIConfig, FakeOpenAIServer
+
+MUNICIPALITIES = ["川崎市", "横浜市", "世田谷区", "町田市", "相模原市"]
+CATEGORIES = [
+    ("4. 交通・アクセス", "4.1 最寄り駅・路線"),
+    ("3. 教育・子育て", "3.2 小学校・中学校"),
+    ("5. 安全・防災", "5.3 ハザードマップ（洪水・地震）"),
+    ("7. 生活利便性", "7.1 スーパー・買い物環境"),
+]
+QUESTIONS = [
+    "最寄り駅はどこですか？",
+    "一番近い駅はどこ？",
+    "子育て環境について教えてください。",
+    "災害のリスクはありますか？",
+    "買い物に便利な場所ですか？",
+]
+
+
+class StageRecorder:
+    """段階ごとのレイテンシとエラー数を記録する (スレッドセーフ)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, stage, seconds):
+        with self.lock:
+            self.latencies.setdefault(stage, []).append(seconds)
+
+    def error(self, stage):
+        with self.lock:
+            self.errors[stage] = self.errors.get(stage, 0) + 1
+
+    def report(self, elapsed):
+        stages = sorted(set(self.latencies) | set(self.errors))
+        report = {}
+        for stage in stages:
+            latencies = np.array(self.latencies.get(stage, [])) * 1000
+            errors = self.errors.get(stage, 0)
+            total = len(latencies) + errors
+            report[stage] = {
+                "count": int(len(latencies)),
+                "errors": errors,
+                "error_rate": errors / total if total else 0.0,
+                "throughput_per_s": len(latencies) / elapsed if elapsed else 0.0,
+                "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+                "p95_ms": float(np.percentile(latencies, 95)) if len(latencies) else None,
+                "p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else None,
+                "max_ms": float(latencies.max()) if len(latencies) else None,
+            }
+        return report
+
+
+def make_document(rng, n_sentences=40, municipality=None):
+    """登録用のテキストとメタデータを生成"""
+    municipality = municipality or rng.choice(MUNICIPALITIES)
+    major_category, medium_category = rng.choice(CATEGORIES)
+    sentences = [
+        f"{municipality}の{medium_category.split(' ', 1)[-1]}に関する情報その{rng.randint(1, 10**6)}です。"
+        f"駅から徒歩{rng.randint(1, 20)}分の範囲に施設が{rng.randint(1, 50)}か所あります。"
+        for _ in range(n_sentences)
+    ]
+    metadata = {
+        "municipality": municipality,
+        "major_category": major_category,
+        "medium_category": medium_category,
+        "source": f"loadtest_{rng.randint(1, 10**9)}.txt",
+    }
+    return "\n".join(sentences), metadata
+
+
+def _ingest(store, journal, splitter, rng, recorder, municipality=None):
+    from langchain_core.documents import Document
+
+    text, metadata = make_document(rng, municipality=municipality)
+    started = time.perf_counter()
+    try:
+        stage = "ingest.split"
+        documents = splitter.split_documents([Document(page_content=text, metadata=metadata)])
+        ids = [f"{metadata['source']}_{doc.metadata['start_index']:08}" for doc in documents]
+        recorder.record(stage, time.perf_counter() - started)
+
+        stage = "ingest.upsert"
+        upsert_started = time.perf_counter()
+        store.upsert_documents(documents=documents, ids=ids, journal=journal, job_id=metadata["source"])
+        recorder.record(stage, time.perf_counter() - upsert_started)
+        recorder.record("ingest", time.perf_counter() - started)
+    except Exception as e:
+        print(f"Ingest failed at {stage}: {e}")
+        recorder.error(stage)
+        recorder.error("ingest")
+
+
+def _ask(store, llm, answer_cache, rng, recorder):
+    from src.rag import answer_question
+
+    municipality = rng.choice(MUNICIPALITIES)
+    filter_conditions = {"municipality": municipality} if rng.random() < 0.7 else None
+    timings = {}
+    started = time.perf_counter()
+    try:
+        result = answer_question(
+            store,
+            llm,
+            f"{municipality}の{rng.choice(QUESTIONS)}",
+            filter_conditions=filter_conditions,
+            answer_cache=answer_cache,
+            timings=timings
+        )
+        for stage, seconds in timings.items():
+            recorder.record(f"ask.{stage}", seconds)
+        if result["answer"] is None:
+            # VectorStore.search は例外を握りつぶして空の結果を返すため、
+            # シード済みのコーパスで結果が空なら検索の失敗として数える
+            print("Ask failed at search: no results")
+            recorder.error("ask.search")
+            recorder.error("ask")
+            return
+        recorder.record("ask", time.perf_counter() - started)
+        if result["cached"]:
+            recorder.record("ask.cache_hit", time.perf_counter() - started)
+    except Exception as e:
+        # 回答生成の後 (キャッシュへの保存など) で失敗した場合は "cache" とする
+        failed = next((s for s in ("embed", "search", "generate") if s not in timings), "cache")
+        print(f"Ask failed at {failed}: {e}")
+        for stage, seconds in timings.items():
+            recorder.record(f"ask.{stage}", seconds)
+        recorder.error(f"ask.{failed}")
+        recorder.error("ask")
+
+
+def run_load_test(
+    users=8,
+    duration=30.0,
+    ask_ratio=0.8,
+    seed_documents=20,
+    use_answer_cache=False,
+    shards=1,
+    server_config=None,
+    retries=0,
+    seed=0,
+):
+    """
+    負荷試験を実行して段階ごとの集計結果を返す
+
+    引数:
+        users: 同時にリクエストを送るユーザー (スレッド) 数
+        duration: 試験時間 (秒)
+        ask_ratio: リクエストのうち質問の割合 (残りは登録)
+        seed_documents: 試験前に登録しておくドキュメント数
+        use_answer_cache: 回答キャッシュを有効にするか
+        shards: VectorStoreのシャード数
+        server_config: フェイクサーバーの設定 (FakeOpenAIConfig)
+        retries: チャットと質問の埋め込みのクライアント側の再試行回数
+            (0なら注入したエラー率がそのまま結果に出る。取り込みのバッチはスケジューラがバックオフする)
+    """
+    with FakeOpenAIServer(server_config) as server, tempfile.TemporaryDirectory() as tmp_dir:
+        # components.llm は読み込み時に環境変数を参照するため、先に設定してから読み込む
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "fake-key")
+        from components.llm import llm as app_llm
+        from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+        from src.answer_cache import SemanticAnswerCache
+        from src.ingest import IngestJournal
+        from src.text_splitter import JapaneseTextSplitter
+        from src.vector_store import VectorStore
+
+        # アプリと同じモデル設定で、再試行回数だけ明示したチャットモデルを使う
+        llm = ChatOpenAI(
+            model=app_llm.model_name,
+            temperature=app_llm.temperature,
+            base_url=server.base_url,
+            max_retries=retries
+        )
+        store = VectorStore(shards=shards)
+        # オフラインで動かすため、埋め込み前のトークン分割 (tiktokenのダウンロードが必要) は行わない
+        store.embeddings = OpenAIEmbeddings(
+            base_url=server.base_url,
+            max_retries=retries,
+            check_embedding_ctx_length=False
+        )
+        store.batch_embeddings = OpenAIEmbeddings(
+            base_url=server.base_url,
+            max_retries=0,
+            check_embedding_ctx_length=False
+        )
+        journal = IngestJournal(os.path.join(tmp_dir, "ingest_journal.db"))
+        answer_cache = None
+        if use_answer_cache:
+            answer_cache = SemanticAnswerCache(os.path.join(tmp_dir, "answer_cache.db"))
+            store.add_change_listener(answer_cache.invalidate_chunks)
+        splitter = JapaneseTextSplitter(chunk_size=512, chunk_overlap=10)
+
+        rng = random.Random(seed)
+        seed_recorder = StageRecorder()
+        # 絞り込み検索が空にならないよう、すべての市区町村のドキュメントを登録しておく
+        for i in range(max(seed_documents, len(MUNICIPALITIES))):
+            _ingest(store, journal, splitter, rng, seed_recorder, MUNICIPALITIES[i % len(MUNICIPALITIES)])
+        print(f"Seeded {store.count()} chunks")
+
+        recorder = StageRecorder()
+        deadline = time.perf_counter() + duration
+
+        def user(index):
+            user_rng = random.Random(seed * 1000 + index)
+            while time.perf_counter() < deadline:
+                if user_rng.random() < ask_ratio:
+                    _ask(store, llm, answer_cache, user_rng, recorder)
+                else:
+                    _ingest(store, journal, splitter, user_rng, recorder)
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=user, args=(i,), name=f"user-{i}") for i in range(users)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        return {
+            "users": users,
+            "duration_s": elapsed,
+            "ask_ratio": ask_ratio,
+            "chunks": store.count(),
+            "retries": {"chat": retries, "query_embeddings": retries, "batch_embeddings": "scheduler backoff"},
+            "server": server.stats,
+            "stages": recorder.report(elapsed),
+        }
+
+
+def print_report(report):
+    print(f"\n{report['users']} users, {report['duration_s']:.1f}s, {report['chunks']} chunks, server: {report['server']}")
+    print(f"client retries: {report['retries']}")
+    print(f"{'stage':<16}{'count':>8}{'err%':>8}{'ops/s':>9}{'p50ms':>10}{'p95ms':>10}{'p99ms':>10}{'maxms':>10}")
+    for stage, s in report["stages"].items():
+        def fmt(value):
+            return f"{value:>10.1f}" if value is not None else f"{'-':>10}"
+        print(
+            f"{stage:<16}{s['count']:>8}{s['error_rate'] * 100:>7.1f}%{s['throughput_per_s']:>9.2f}"
+            f"{fmt(s['p50_ms'])}{fmt(s['p95_ms'])}{fmt(s['p99_ms'])}{fmt(s['max_ms'])}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=8, help="同時ユーザー数")
+    parser.add_argument("--duration", type=float, default=30.0, help="試験時間 (秒)")
+    parser.add_argument("--ask-ratio", type=float, default=0.8, help="質問の割合 (残りは登録)")
+    parser.add_argument("--seed-documents", type=int, default=20, help="試験前に登録するドキュメント数")
+    parser.add_argument("--answer-cache", action="store_true", help="回答キャッシュを有効にする")
+    parser.add_argument("--shards", type=int, default=1, help="VectorStoreのシャード数")
+    parser.add_argument("--chat-latency-ms", type=float, default=500.0)
+    parser.add_argument("--chat-tokens-per-second", type=float, default=100.0)
+    parser.add_argument("--embed-latency-ms", type=float, default=50.0)
+    parser.add_argument("--max-concurrency", type=int, default=64, help="フェイクサーバーの同時処理数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="500を返す確率")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="429を返す確率")
+    parser.add_argument("--retries", type=int, default=0, help="チャットと質問の埋め込みのクライアント側の再試行回数")
+    parser.add_argument("--json", help="集計結果をJSONで書き出すパス")
+    args = parser.parse_args()
+
+    report = run_load_test(
+        users=args.users,
+        duration=args.duration,
+        ask_ratio=args.ask_ratio,
+        seed_documents=args.seed_documents,
+        use_answer_cache=args.answer_cache,
+        shards=args.shards,
+        retries=args.retries,
+        server_config=FakeOpenAIConfig(
+            chat_latency_ms=args.chat_latency_ms,
+            chat_tokens_per_second=args.chat_tokens_per_second,
+            embed_latency_ms=args.embed_latency_ms,
+            max_concurrency=args.max_concurrency,
+            error_rate=args.error_rate,
+            rate_limit_rate=args.rate_limit_rate,
+        ),
+    )
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,8 @@ import os
 from dotenv import load_dotenv
 load_dotenv() # .envファイルは親ディレクトリ方向に探索される
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+# OpenAI互換サーバー (負荷試験用のフェイクサーバーなど) を使う場合に指定
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL')
 from langchain_openai import ChatOpenAI
 from langchain_openai import OpenAIEmbeddings
 
@@ -9,13 +11,15 @@ from langchain_openai import OpenAIEmbeddings
 llm = ChatOpenAI(
     model="gpt-4o-mini",  # または "gpt-3.5-turbo" を使用
     temperature=0,
-    api_key=OPENAI_API_KEY
+    api_key=OPENAI_API_KEY,
+    base_url=OPENAI_BASE_URL
 )
 
 # Embedding モデル
 oai_embeddings = OpenAIEmbeddings(
     model="text-embedding-3-small",
-    api_key=OPENAI_API_KEY
+    api_key=OPENAI_API_KEY,
+    base_url=OPENAI_BASE_URL
 )
 
 # 動作確認
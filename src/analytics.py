@@ -0,0 +1,165 @@
+import threading
+
+import duckdb
+import pyarrow as pa
+
+# 集計対象とするメタデータ列
+METADATA_COLUMNS = [
+    "municipality",
+    "major_category",
+    "medium_category",
+    "source",
+    "registration_date",
+    "publication_date",
+]
+
+
+class CorpusAnalytics:
+    """
+    コレクションのメタデータをDuckDBの列指向テーブルに保持し、集計クエリに答える
+
+    VectorStoreの書き込み・削除に合わせて upsert / delete が呼ばれ、
+    コレクションと同じ内容に保たれる。
+    """
+
+    def __init__(self):
+        self.con = duckdb.connect(database=":memory:")
+        self.lock = threading.Lock()
+        columns = ", ".join(f"{c} VARCHAR" for c in METADATA_COLUMNS)
+        self.con.execute(f"CREATE TABLE chunks (id VARCHAR, {columns})")
+
+    def _to_table(self, ids, metadatas):
+        """IDとメタデータのリストをArrowテーブルに変換"""
+        arrays = [pa.array(ids, type=pa.string())]
+        for column in METADATA_COLUMNS:
+            arrays.append(pa.array(
+                [str((m or {}).get(column, "") or "") for m in metadatas],
+                type=pa.string()
+            ))
+        return pa.Table.from_arrays(arrays, names=["id"] + METADATA_COLUMNS)
+
+    def upsert(self, ids, metadatas):
+        """チャンクのメタデータを追加または更新"""
+        if not ids:
+            return
+        batch = self._to_table(ids, metadatas)
+        with self.lock:
+            self.con.register("incoming", batch)
+            try:
+                self.con.execute("DELETE FROM chunks WHERE id IN (SELECT id FROM incoming)")
+                self.con.execute("INSERT INTO chunks SELECT * FROM incoming")
+            finally:
+                self.con.unregister("incoming")
+
+    def delete(self, ids):
+        """チャンクのメタデータを削除"""
+        if not ids:
+            return
+        with self.lock:
+            self.con.register("removed", pa.table({"id": pa.array(ids, type=pa.string())}))
+            try:
+                self.con.execute("DELETE FROM chunks WHERE id IN (SELECT id FROM removed)")
+            finally:
+                self.con.unregister("removed")
+
+    def rebuild(self, batches):
+        """コレクションの内容 (get()の結果のバッチ列) からテーブルを作り直す"""
+        with self.lock:
+            self.con.execute("DELETE FROM chunks")
+        total = 0
+        for batch in batches:
+            self.upsert(batch['ids'], batch['metadatas'])
+            total += len(batch['ids'])
+        print(f"Rebuilt analytics table with {total} chunks")
+        return total
+
+    def _query(self, sql, params=None):
+        with self.lock:
+            return self.con.execute(sql, params or []).df()
+
+    def count(self):
+        """テーブルに保持しているチャンク数"""
+        with self.lock:
+            return self.con.execute("SELECT count(*) FROM chunks").fetchone()[0]
+
+    def counts_by(self, columns):
+        """
+        指定した列の組み合わせごとのチャンク数を集計
+
+        引数:
+            columns: 集計キーにする列名のリスト (METADATA_COLUMNS のいずれか)
+        """
+        unknown = [c for c in columns if c not in METADATA_COLUMNS]
+        if not columns or unknown:
+            raise ValueError(f"Unsupported columns for aggregation: {unknown or columns}")
+        keys = ", ".join(columns)
+        return self._query(
+            f"SELECT {keys}, count(*) AS chunks FROM chunks "
+            f"GROUP BY {keys} ORDER BY chunks DESC, {keys}"
+        )
+
+    def category_matrix(self, category_column="major_category"):
+        """市区町村 × カテゴリのチャンク数のクロス集計"""
+        counts = self.counts_by(["municipality", category_column])
+        if counts.empty:
+            return counts
+        return counts.pivot_table(
+            index="municipality",
+            columns=category_column,
+            values="chunks",
+            aggfunc="sum",
+            fill_value=0
+        ).astype(int)
+
+    def coverage_gaps(self, medium_categories):
+        """
+        市区町村ごとに、登録チャンクが1件もない中カテゴリを列挙
+
+        引数:
+            medium_categories: {大カテゴリ: [中カテゴリ, ...]} の辞書
+        """
+        taxonomy = pa.table({
+            "major_category": [major for major, mediums in medium_categories.items() for _ in mediums],
+            "medium_category": [medium for mediums in medium_categories.values() for medium in mediums],
+        })
+        with self.lock:
+            self.con.register("taxonomy", taxonomy)
+            try:
+                return self.con.execute(
+                    """
+                    SELECT m.municipality, t.major_category, t.medium_category
+                    FROM (SELECT DISTINCT municipality FROM chunks WHERE municipality <> '') m
+                    CROSS JOIN taxonomy t
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM chunks c
+                        WHERE c.municipality = m.municipality
+                        AND c.medium_category = t.medium_category
+                    )
+                    ORDER BY m.municipality, t.major_category, t.medium_category
+                    """
+                ).df()
+            finally:
+                self.con.unregister("taxonomy")
+
+    def stale_sources(self, before):
+        """
+        最新のデータ公開日が指定日より古い (または未設定の) ソース元を列挙
+
+        引数:
+            before: 基準日 (datetime.date または "YYYY-MM-DD")
+        """
+        return self._query(
+            """
+            SELECT
+                source,
+                string_agg(DISTINCT municipality, ', ') AS municipalities,
+                max(TRY_CAST(NULLIF(publication_date, '') AS DATE)) AS latest_publication_date,
+                count(*) AS chunks
+            FROM chunks
+            GROUP BY source
+            HAVING max(TRY_CAST(NULLIF(publication_date, '') AS DATE)) IS NULL
+                OR max(TRY_CAST(NULLIF(publication_date, '') AS DATE)) < CAST(? AS DATE)
+            ORDER BY latest_publication_date NULLS FIRST, source
+            """,
+            [str(before)]
+        )
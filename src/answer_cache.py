@@ -0,0 +1,264 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from src.ingest import content_hash
+
+# 回答キャッシュの保存先と既定値
+DEFAULT_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", "answer_cache.db")
+DEFAULT_SIMILARITY_THRESHOLD = 0.92
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 10000
+
+
+def _filter_key(filter_conditions):
+    """フィルタリング条件を順序に依存しない文字列にする"""
+    conditions = {k: v for k, v in (filter_conditions or {}).items() if k and v}
+    return json.dumps(conditions, ensure_ascii=False, sort_keys=True)
+
+
+def _filter_shape(filter_conditions):
+    """フィルタリング条件に使われている項目の組み合わせ (値は含めない)"""
+    keys = sorted(k for k, v in (filter_conditions or {}).items() if k and v)
+    return json.dumps(keys)
+
+
+def _chunk_key(chunk_ids, documents):
+    """検索されたチャンクのIDと内容のハッシュの組の集合を文字列にする"""
+    return "\n".join(sorted({
+        f"{chunk_id}:{content_hash(document)}" for chunk_id, document in zip(chunk_ids, documents)
+    }))
+
+
+def _normalize(embedding):
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticAnswerCache:
+    """
+    言い換えられた質問に対して生成済みの回答を返すキャッシュ
+
+    エントリは質問の埋め込み・フィルタリング条件・検索されたチャンク (IDと内容のハッシュの組) の集合で管理し、
+    条件とチャンク集合が一致し、質問の類似度が閾値以上のときにヒットとする。
+    チャンクの内容が変わるとハッシュが変わるため、再起動をまたいでも古い回答は返さない。
+    削除されたチャンクを元にしたエントリは invalidate_chunks で削除する。
+    """
+
+    def __init__(
+        self,
+        path=DEFAULT_CACHE_PATH,
+        similarity_threshold=DEFAULT_SIMILARITY_THRESHOLD,
+        ttl_seconds=DEFAULT_TTL_SECONDS,
+        max_entries=DEFAULT_MAX_ENTRIES,
+    ):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS answers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                filter_key TEXT NOT NULL,
+                chunk_key TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_hit REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                prewarmed INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS answers_lookup ON answers (filter_key, chunk_key);
+            CREATE TABLE IF NOT EXISTS answer_chunks (
+                answer_id INTEGER NOT NULL,
+                chunk_id TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS answer_chunks_chunk ON answer_chunks (chunk_id);
+            CREATE TABLE IF NOT EXISTS query_stats (
+                filter_shape TEXT PRIMARY KEY,
+                lookups INTEGER NOT NULL DEFAULT 0,
+                hits INTEGER NOT NULL DEFAULT 0,
+                prewarmed_hits INTEGER NOT NULL DEFAULT 0
+            );
+            """
+        )
+        # 以前のバージョンで作成したファイルには prewarmed 列がない
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(answers)").fetchall()]
+        if "prewarmed" not in columns:
+            self.conn.execute("ALTER TABLE answers ADD COLUMN prewarmed INTEGER NOT NULL DEFAULT 0")
+        self.conn.commit()
+
+    def lookup(self, question_embedding, filter_conditions, chunk_ids, documents, record=True):
+        """
+        類似した質問の回答を探す
+
+        引数:
+            question_embedding: 質問の埋め込みベクトル
+            filter_conditions: 検索時のフィルタリング条件
+            chunk_ids: 検索されたチャンクIDのリスト
+            documents: 検索されたチャンクの内容のリスト (chunk_idsと同じ順序)
+            record: フィルタ条件の組み合わせごとの利用回数・ヒット率に記録するか
+                (事前生成ジョブ自身の確認では記録しない)
+        戻り値:
+            キャッシュされた回答 (見つからない場合はNone)
+        """
+        query = _normalize(question_embedding)
+        now = time.time()
+        answer = None
+        prewarmed = False
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, embedding, answer, prewarmed FROM answers "
+                "WHERE filter_key = ? AND chunk_key = ? AND created_at >= ?",
+                (_filter_key(filter_conditions), _chunk_key(chunk_ids, documents), now - self.ttl_seconds)
+            ).fetchall()
+            similarity = None
+            if rows:
+                vectors = np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+                similarities = vectors @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    entry_id, _, answer, prewarmed = rows[best]
+                    similarity = similarities[best]
+                    self.conn.execute(
+                        "UPDATE answers SET hits = hits + 1, last_hit = ? WHERE id = ?",
+                        (now, entry_id)
+                    )
+            if record:
+                hit = answer is not None
+                self.conn.execute(
+                    "INSERT INTO query_stats (filter_shape, lookups, hits, prewarmed_hits) VALUES (?, 1, ?, ?) "
+                    "ON CONFLICT(filter_shape) DO UPDATE SET lookups = lookups + 1, "
+                    "hits = hits + excluded.hits, prewarmed_hits = prewarmed_hits + excluded.prewarmed_hits",
+                    (_filter_shape(filter_conditions), int(hit), int(hit and bool(prewarmed)))
+                )
+            self.conn.commit()
+        if answer is not None:
+            print(f"Answer cache hit (similarity {similarity:.3f})")
+        return answer
+
+    def query_stats(self):
+        """
+        フィルタ条件の組み合わせごとの利用回数とヒット率
+
+        戻り値:
+            {"filter_keys": 項目のタプル, "lookups": 検索回数, "hits": ヒット数,
+             "prewarmed_hits": 事前生成した回答へのヒット数, "hit_rate": ヒット率} のリスト (利用回数の多い順)
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT filter_shape, lookups, hits, prewarmed_hits FROM query_stats ORDER BY lookups DESC"
+            ).fetchall()
+        return [
+            {
+                "filter_keys": tuple(json.loads(shape)),
+                "lookups": lookups,
+                "hits": hits,
+                "prewarmed_hits": prewarmed_hits,
+                "hit_rate": hits / lookups if lookups else 0.0,
+            }
+            for shape, lookups, hits, prewarmed_hits in rows
+        ]
+
+    def prewarmed_questions(self):
+        """
+        事前生成した回答がある質問とフィルタリング条件 (質問ページのよくある質問に使う)
+
+        同じ文面・同じ条件で質問すれば検索結果も同じになるため、事前生成した回答にそのままヒットする。
+
+        戻り値:
+            (質問, フィルタリング条件) のリスト (ヒット数の多い順)
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT question, filter_key FROM answers WHERE prewarmed = 1 AND created_at >= ? "
+                "GROUP BY question, filter_key ORDER BY SUM(hits) DESC, question, filter_key",
+                (time.time() - self.ttl_seconds,)
+            ).fetchall()
+        return [(question, json.loads(filter_key)) for question, filter_key in rows]
+
+    def put(self, question, question_embedding, filter_conditions, chunk_ids, documents, answer, prewarmed=False):
+        """
+        生成した回答をキャッシュに保存
+
+        引数:
+            prewarmed: 事前生成ジョブが作成した回答か (ヒット率の集計に使う)
+        """
+        now = time.time()
+        with self.lock:
+            cursor = self.conn.execute(
+                "INSERT INTO answers (filter_key, chunk_key, embedding, question, answer, created_at, last_hit, prewarmed) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    _filter_key(filter_conditions),
+                    _chunk_key(chunk_ids, documents),
+                    _normalize(question_embedding).tobytes(),
+                    question,
+                    answer,
+                    now,
+                    now,
+                    int(prewarmed),
+                )
+            )
+            self.conn.executemany(
+                "INSERT INTO answer_chunks (answer_id, chunk_id) VALUES (?, ?)",
+                [(cursor.lastrowid, chunk_id) for chunk_id in set(chunk_ids)]
+            )
+            self._evict(now)
+            self.conn.commit()
+
+    def _evict(self, now):
+        """期限切れのエントリと、上限を超えた分の最近使われていないエントリを削除"""
+        self.conn.execute("DELETE FROM answers WHERE created_at < ?", (now - self.ttl_seconds,))
+        self.conn.execute(
+            "DELETE FROM answers WHERE id IN ("
+            "SELECT id FROM answers ORDER BY last_hit DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+        self.conn.execute("DELETE FROM answer_chunks WHERE answer_id NOT IN (SELECT id FROM answers)")
+
+    def invalidate_chunks(self, chunk_ids):
+        """指定したチャンクを元にしたエントリを削除 (チャンクの削除時に呼び出す)"""
+        if not chunk_ids:
+            return 0
+        removed = 0
+        with self.lock:
+            chunk_ids = list(chunk_ids)
+            # SQLiteのパラメータ数の上限を超えないように分割する
+            for i in range(0, len(chunk_ids), 500):
+                part = chunk_ids[i:i + 500]
+                placeholders = ", ".join("?" for _ in part)
+                entry_ids = [row[0] for row in self.conn.execute(
+                    f"SELECT DISTINCT answer_id FROM answer_chunks WHERE chunk_id IN ({placeholders})",
+                    part
+                ).fetchall()]
+                if not entry_ids:
+                    continue
+                id_placeholders = ", ".join("?" for _ in entry_ids)
+                self.conn.execute(f"DELETE FROM answers WHERE id IN ({id_placeholders})", entry_ids)
+                self.conn.execute(f"DELETE FROM answer_chunks WHERE answer_id IN ({id_placeholders})", entry_ids)
+                removed += len(entry_ids)
+            self.conn.commit()
+        if removed:
+            print(f"Invalidated {removed} cached answers")
+        return removed
+
+    def clear(self):
+        """すべてのエントリを削除"""
+        with self.lock:
+            self.conn.execute("DELETE FROM answers")
+            self.conn.execute("DELETE FROM answer_chunks")
+            self.conn.execute("DELETE FROM query_stats")
+            self.conn.commit()
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT count(*) FROM answers").fetchone()[0]
@@ -0,0 +1,166 @@
+import os
+import re
+import threading
+import unicodedata
+import zlib
+
+import numpy as np
+
+# 重複チャンクの扱い
+#   skip: 登録しない
+#   link: 既存チャンクの埋め込みを再利用して登録し、メタデータ duplicate_of に既存チャンクのIDを入れる
+#   keep: 通常どおり埋め込みを生成して登録する (検出数だけ数える)
+DEDUP_POLICIES = ["skip", "link", "keep"]
+DEFAULT_DEDUP_POLICY = os.getenv("DEDUP_POLICY", "link")
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_WHITESPACE = re.compile(r"\s+")
+
+
+class MinHashLSH:
+    """
+    文字n-gramのMinHash署名とバンド分割によるLSHインデックス
+
+    署名の一致率で推定したJaccard係数が threshold 以上のものを重複とみなす。
+    """
+
+    def __init__(self, num_perm=128, bands=16, shingle_size=5, threshold=0.8, seed=1):
+        if num_perm % bands != 0:
+            raise ValueError(f"num_perm ({num_perm}) must be divisible by bands ({bands})")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.threshold = threshold
+        rng = np.random.default_rng(seed)
+        # a * x + b が uint64 に収まるように係数は 2**31 未満にする
+        self.a = rng.integers(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 31, size=num_perm, dtype=np.uint64)
+        self.signatures = {}
+        self.buckets = [{} for _ in range(bands)]
+        self.lock = threading.Lock()
+
+    def signature(self, text):
+        """テキストのMinHash署名を計算 (全角・半角や空白の違いは無視する)"""
+        normalized = _WHITESPACE.sub("", unicodedata.normalize("NFKC", text))
+        n = self.shingle_size
+        shingles = {normalized[i:i + n] for i in range(max(1, len(normalized) - n + 1))}
+        hashes = np.fromiter(
+            (zlib.crc32(s.encode("utf-8")) for s in shingles),
+            dtype=np.uint64,
+            count=len(shingles)
+        )
+        # (a * x + b) mod p を各置換について計算し、その最小値を署名とする
+        permuted = (np.outer(hashes, self.a) + self.b) % _MERSENNE_PRIME
+        return (permuted & _MAX_HASH).min(axis=0)
+
+    def _band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def add(self, key, signature):
+        with self.lock:
+            if key in self.signatures:
+                self._remove(key)
+            self.signatures[key] = signature
+            for bucket, band_key in zip(self.buckets, self._band_keys(signature)):
+                bucket.setdefault(band_key, set()).add(key)
+
+    def _remove(self, key):
+        signature = self.signatures.pop(key, None)
+        if signature is None:
+            return
+        for bucket, band_key in zip(self.buckets, self._band_keys(signature)):
+            members = bucket.get(band_key)
+            if members is not None:
+                members.discard(key)
+                if not members:
+                    del bucket[band_key]
+
+    def remove(self, key):
+        with self.lock:
+            self._remove(key)
+
+    def query(self, signature, exclude=()):
+        """
+        最も似ている登録済みのキーを探す
+
+        引数:
+            exclude: 候補から除外するキーの集合
+        戻り値:
+            (キー, 推定Jaccard係数) のタプル。閾値以上のものがなければNone
+        """
+        with self.lock:
+            candidates = set()
+            for bucket, band_key in zip(self.buckets, self._band_keys(signature)):
+                candidates.update(bucket.get(band_key, ()))
+            candidates.difference_update(exclude)
+            best = None
+            for key in candidates:
+                similarity = float(np.mean(self.signatures[key] == signature))
+                if similarity >= self.threshold and (best is None or similarity > best[1]):
+                    best = (key, similarity)
+            return best
+
+    def __len__(self):
+        return len(self.signatures)
+
+
+class Deduplicator:
+    """
+    取り込み時に既存チャンク・同じバッチ内のチャンクとの重複を検出する
+
+    コレクションと同じ内容のLSHインデックスを保持し、埋め込みを生成する前に判定する。
+    インデックスにはコレクションへの書き込みが成功したチャンクだけを登録する。
+    """
+
+    def __init__(self, policy=DEFAULT_DEDUP_POLICY, threshold=0.8):
+        if policy not in DEDUP_POLICIES:
+            raise ValueError(f"Unknown dedup policy: {policy} (expected one of {DEDUP_POLICIES})")
+        self.policy = policy
+        self.threshold = threshold
+        self.index = MinHashLSH(threshold=threshold)
+
+    def plan(self, ids, texts):
+        """
+        各チャンクが重複かどうかを判定 (インデックスは変更しない)
+
+        書き込み済みのチャンクとの比較にはインデックスを、同じバッチ内のチャンク同士の比較には
+        バッチ内だけの一時的なインデックスを使う。バッチ内で書き換えられるIDは既存の内容と比較しない。
+
+        戻り値:
+            {インデックス: 重複元のチャンクID} の辞書
+        """
+        batch_index = MinHashLSH(threshold=self.threshold)
+        batch_ids = set(ids)
+        duplicates = {}
+        for i, (doc_id, text) in enumerate(zip(ids, texts)):
+            signature = self.index.signature(text)
+            match = self.index.query(signature, exclude=batch_ids)
+            if match is None:
+                match = batch_index.query(signature, exclude=(doc_id,))
+            if match is not None:
+                duplicates[i] = match[0]
+                continue
+            # 同じバッチ内の後続チャンクと比較できるように一時的なインデックスに登録する
+            batch_index.add(doc_id, signature)
+        return duplicates
+
+    def add(self, ids, texts):
+        """コレクションに書き込まれたチャンクをインデックスに登録"""
+        for doc_id, text in zip(ids, texts):
+            self.index.add(doc_id, self.index.signature(text))
+
+    def remove(self, ids):
+        """コレクションから削除されたチャンクをインデックスから削除"""
+        for doc_id in ids:
+            self.index.remove(doc_id)
+
+    def rebuild(self, batches):
+        """コレクションの内容 (get()の結果のバッチ列) からインデックスを作り直す"""
+        total = 0
+        for batch in batches:
+            self.add(batch['ids'], batch['documents'])
+            total += len(batch['ids'])
+        print(f"Rebuilt dedup index with {total} chunks")
+        return total
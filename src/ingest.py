@@ -0,0 +1,206 @@
+import hashlib
+import os
+import random
+import sqlite3
+import threading
+import time
+
+# 埋め込みAPIの1リクエストあたりの上限
+MAX_TOKENS_PER_REQUEST = 300000
+MAX_INPUTS_PER_REQUEST = 2048
+
+# 取り込みジャーナルの保存先
+DEFAULT_JOURNAL_PATH = os.getenv("INGEST_JOURNAL_PATH", "ingest_journal.db")
+
+
+def content_hash(text, metadata=None):
+    """チャンクの内容とメタデータからハッシュ値を計算"""
+    h = hashlib.sha256(text.encode("utf-8"))
+    if metadata:
+        h.update(repr(sorted(metadata.items())).encode("utf-8"))
+    return h.hexdigest()
+
+
+class IngestJournal:
+    """
+    どのチャンクが埋め込み・書き込み済みかを記録するSQLiteのジャーナル
+
+    取り込みが途中で失敗しても、同じジョブを再実行すると
+    未完了のチャンクだけが処理される。
+    """
+
+    def __init__(self, path=DEFAULT_JOURNAL_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ingest_journal (
+                job_id TEXT NOT NULL,
+                chunk_id TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                completed_at REAL NOT NULL,
+                PRIMARY KEY (job_id, chunk_id)
+            )
+            """
+        )
+        self.conn.commit()
+
+    def completed(self, job_id):
+        """ジョブで完了済みのチャンクID→ハッシュ値の辞書"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT chunk_id, content_hash FROM ingest_journal WHERE job_id = ?",
+                (job_id,)
+            ).fetchall()
+        return dict(rows)
+
+    def mark_done(self, job_id, ids, hashes):
+        """チャンクを完了済みとして記録"""
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO ingest_journal VALUES (?, ?, ?, ?)",
+                [(job_id, chunk_id, h, now) for chunk_id, h in zip(ids, hashes)]
+            )
+            self.conn.commit()
+
+    def finish(self, job_id):
+        """ジョブが最後まで完了したので記録を削除"""
+        with self.lock:
+            self.conn.execute("DELETE FROM ingest_journal WHERE job_id = ?", (job_id,))
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def _estimate_tokens_factory():
+    """tiktokenが使えればそれで、使えなければ文字数でトークン数を見積もる関数を返す"""
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding("cl100k_base")
+        return lambda text: len(encoding.encode(text, disallowed_special=()))
+    except Exception:
+        # 日本語はおおむね1文字1トークン以上になるので文字数で代用
+        return len
+
+
+def _is_rate_limited(error):
+    """429 (レート制限) のエラーかどうか"""
+    status = getattr(error, "status_code", None)
+    if status is None and getattr(error, "response", None) is not None:
+        status = getattr(error.response, "status_code", None)
+    return status == 429 or type(error).__name__ == "RateLimitError"
+
+
+def _is_request_too_large(error):
+    """1リクエストあたりのトークン数上限を超えたエラーかどうか"""
+    status = getattr(error, "status_code", None)
+    message = str(error).lower()
+    return (status == 400 or type(error).__name__ == "BadRequestError") and (
+        "max" in message and "token" in message
+    )
+
+
+def _retry_after(error):
+    """レスポンスのRetry-Afterヘッダーの秒数 (なければNone)"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveBatchScheduler:
+    """
+    トークン数に基づいてバッチを組み、429を受けたら縮小・待機し、
+    成功が続けば徐々にバッチを大きくする (AIMD) 埋め込みのスケジューラ
+    """
+
+    def __init__(
+        self,
+        max_tokens=MAX_TOKENS_PER_REQUEST,
+        initial_tokens=50000,
+        min_tokens=1000,
+        increase_tokens=10000,
+        max_inputs=MAX_INPUTS_PER_REQUEST,
+        max_retries=8,
+        base_delay=1.0,
+        max_delay=60.0,
+        sleep=time.sleep,
+    ):
+        self.max_tokens = max_tokens
+        self.min_tokens = min_tokens
+        self.increase_tokens = increase_tokens
+        self.max_inputs = max_inputs
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.token_budget = min(initial_tokens, max_tokens)
+        self.lock = threading.Lock()
+        self.estimate_tokens = _estimate_tokens_factory()
+
+    def _next_batch(self, token_counts, start):
+        """startから現在のトークン予算に収まるだけのバッチの終端を返す"""
+        budget = self.token_budget
+        end = start
+        used = 0
+        while end < len(token_counts) and end - start < self.max_inputs:
+            if end > start and used + token_counts[end] > budget:
+                break
+            used += token_counts[end]
+            end += 1
+        return end
+
+    def _on_success(self):
+        with self.lock:
+            self.token_budget = min(self.max_tokens, self.token_budget + self.increase_tokens)
+
+    def _on_throttled(self):
+        with self.lock:
+            self.token_budget = max(self.min_tokens, self.token_budget // 2)
+
+    def run(self, texts, embed_fn, on_batch):
+        """
+        テキストをバッチに分けて埋め込みを生成する
+
+        引数:
+            texts: 埋め込むテキストのリスト
+            embed_fn: テキストのリストを受け取り埋め込みのリストを返す関数
+            on_batch: (開始位置, 終了位置, 埋め込みのリスト) を受け取るコールバック
+        """
+        token_counts = [self.estimate_tokens(text) for text in texts]
+        start = 0
+        attempt = 0
+        while start < len(texts):
+            end = self._next_batch(token_counts, start)
+            try:
+                embeddings = embed_fn(texts[start:end])
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    raise
+                if _is_rate_limited(e):
+                    self._on_throttled()
+                    delay = _retry_after(e)
+                    if delay is None:
+                        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+                        delay *= random.uniform(0.5, 1.0)
+                    print(f"Rate limited, retrying in {delay:.1f}s with token budget {self.token_budget}")
+                    self.sleep(delay)
+                elif _is_request_too_large(e) and end - start > 1:
+                    self._on_throttled()
+                    print(f"Request too large, shrinking token budget to {self.token_budget}")
+                else:
+                    raise
+                attempt += 1
+                continue
+
+            if len(embeddings) != end - start:
+                raise ValueError(f"Generated {len(embeddings)} embeddings for {end - start} texts")
+            on_batch(start, end, embeddings)
+            self._on_success()
+            attempt = 0
+            start = end
@@ -0,0 +1,218 @@
+import datetime
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.rag import answer_question
+
+# 事前生成を行う時間帯 (開始時-終了時、ローカル時刻) と同時実行数の既定値
+# (環境変数 PREWARM_HOURS / PREWARM_CONCURRENCY は PrewarmJob の初期化時に読み込む)
+DEFAULT_PREWARM_HOURS = "1-5"
+DEFAULT_PREWARM_CONCURRENCY = 2
+
+# 中カテゴリごとの定型質問
+QUESTION_TEMPLATE = "{municipality}の{topic}について教えてください。"
+
+# 事前生成で再現できるフィルタ項目と、利用実績がないときに使うフィルタ条件の組み合わせ
+# (回答キャッシュはフィルタ条件が一致しないとヒットしないため、質問ページで実際に使われる組み合わせで生成する)
+PREWARM_FILTER_KEYS = ("municipality", "major_category", "medium_category")
+DEFAULT_FILTER_SHAPES = [(), ("municipality",), ("major_category", "medium_category", "municipality")]
+DEFAULT_MAX_FILTER_SHAPES = 3
+
+
+def parse_hours(hours):
+    """"1-5" のような時間帯の指定を (開始時, 終了時) に変換"""
+    try:
+        start, end = (int(h) for h in hours.split("-"))
+    except ValueError:
+        raise ValueError(f"PREWARM_HOURS must be two integer hours like '1-5', got '{hours}'")
+    if not (0 <= start <= 24 and 0 <= end <= 24):
+        raise ValueError(f"PREWARM_HOURS must be hours between 0 and 24, got '{hours}'")
+    return start, end
+
+
+def concurrency_from_env():
+    """環境変数 PREWARM_CONCURRENCY から事前生成の同時実行数を読み込む"""
+    value = os.getenv("PREWARM_CONCURRENCY") or str(DEFAULT_PREWARM_CONCURRENCY)
+    try:
+        concurrency = int(value)
+    except ValueError:
+        raise ValueError(f"PREWARM_CONCURRENCY must be an integer, got '{value}'")
+    if concurrency < 1:
+        raise ValueError(f"PREWARM_CONCURRENCY must be at least 1, got '{value}'")
+    return concurrency
+
+
+def in_window(hour, window):
+    """時刻が時間帯に含まれるか (日をまたぐ指定 "22-3" にも対応)"""
+    start, end = window
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+
+def build_questions(medium_categories, combinations, filter_shapes=DEFAULT_FILTER_SHAPES):
+    """
+    登録済みの (市区町村, 大カテゴリ, 中カテゴリ) の組み合わせから定型質問を作る
+
+    引数:
+        medium_categories: {大カテゴリ: [中カテゴリ, ...]} の辞書
+        combinations: (市区町村, 大カテゴリ, 中カテゴリ) のタプルの集合
+        filter_shapes: 生成するフィルタ条件の項目の組み合わせのリスト (空のタプルはフィルタなし)
+    戻り値:
+        (質問, フィルタリング条件) のリスト
+    """
+    questions = []
+    for major_category, mediums in medium_categories.items():
+        for medium_category in mediums:
+            # "4.1 最寄り駅・路線" → "最寄り駅・路線"
+            topic = medium_category.split(" ", 1)[-1].strip()
+            for municipality, major, medium in sorted(combinations):
+                if major != major_category or medium != medium_category:
+                    continue
+                values = {
+                    "municipality": municipality,
+                    "major_category": major_category,
+                    "medium_category": medium_category,
+                }
+                question = QUESTION_TEMPLATE.format(municipality=municipality, topic=topic)
+                for shape in filter_shapes:
+                    questions.append((question, {key: values[key] for key in shape} or None))
+    return questions
+
+
+class PrewarmJob:
+    """
+    よく聞かれる定型質問の回答をあらかじめ生成し、回答キャッシュに保存するバックグラウンドジョブ
+
+    回答キャッシュは元になったチャンクが変更されると無効になるため、
+    定期的に実行すると変更のあった質問だけが生成し直される。
+    回答キャッシュはフィルタ条件と検索されたチャンクの集合が一致したときだけヒットするため、
+    フィルタ条件は質問ページで実際に使われている組み合わせに合わせる。
+    生成した定型質問は質問ページの「よくある質問」に表示され、同じ文面・同じ条件で送られるので、
+    チャンクが変わっていなければそのままヒットする。
+    言い換えによって検索結果が変わった質問にはヒットしないので、効果は
+    SemanticAnswerCache.query_stats() の prewarmed_hits で確認する。
+    """
+
+    def __init__(
+        self,
+        vector_store,
+        llm,
+        answer_cache,
+        medium_categories,
+        hours=None,
+        concurrency=None,
+        interval_seconds=30 * 60,
+        max_filter_shapes=DEFAULT_MAX_FILTER_SHAPES,
+    ):
+        self.vector_store = vector_store
+        self.llm = llm
+        self.answer_cache = answer_cache
+        self.medium_categories = medium_categories
+        self.window = parse_hours(hours or os.getenv("PREWARM_HOURS") or DEFAULT_PREWARM_HOURS)
+        self.concurrency = concurrency_from_env() if concurrency is None else concurrency
+        self.interval_seconds = interval_seconds
+        self.max_filter_shapes = max_filter_shapes
+        self.stop_event = threading.Event()
+        self.run_lock = threading.Lock()
+        self.thread = None
+        self.last_stats = None
+        # 定型質問の文面は変わらないので埋め込みを使い回す
+        self.question_embeddings = {}
+
+    def _combinations(self):
+        """チャンクが登録されている (市区町村, 大カテゴリ, 中カテゴリ) の組み合わせ"""
+        if self.vector_store.analytics is not None:
+            counts = self.vector_store.analytics.counts_by(["municipality", "major_category", "medium_category"])
+            rows = counts[["municipality", "major_category", "medium_category"]].itertuples(index=False)
+        else:
+            metadatas = self.vector_store.get_documents().get('metadatas') or []
+            rows = [
+                (m.get('municipality', ''), m.get('major_category', ''), m.get('medium_category', ''))
+                for m in metadatas if m
+            ]
+        return {tuple(row) for row in rows if all(row)}
+
+    def filter_shapes(self):
+        """
+        質問ページでよく使われるフィルタ条件の項目の組み合わせ (事前生成で再現できるものだけ)
+
+        回答キャッシュに記録された利用回数の多い順に選び、記録がなければ既定の組み合わせを使う。
+        """
+        shapes = [
+            row["filter_keys"] for row in self.answer_cache.query_stats()
+            if row["lookups"] and set(row["filter_keys"]) <= set(PREWARM_FILTER_KEYS)
+        ]
+        return shapes[:self.max_filter_shapes] or list(DEFAULT_FILTER_SHAPES)
+
+    def _embed(self, questions):
+        missing = list(dict.fromkeys(q for q, _ in questions if q not in self.question_embeddings))
+        if missing:
+            for question, embedding in zip(missing, self.vector_store.embeddings.embed_documents(missing)):
+                self.question_embeddings[question] = embedding
+
+    def _answer(self, item):
+        question, filter_conditions = item
+        if self.stop_event.is_set():
+            return "stopped"
+        try:
+            result = answer_question(
+                self.vector_store,
+                self.llm,
+                question,
+                filter_conditions=filter_conditions,
+                answer_cache=self.answer_cache,
+                query_embedding=self.question_embeddings[question],
+                prewarm=True
+            )
+        except Exception as e:
+            print(f"Error prewarming '{question}': {e}")
+            return "errors"
+        if result["answer"] is None:
+            return "empty"
+        return "cached" if result["cached"] else "generated"
+
+    def run_once(self):
+        """
+        すべての定型質問について、キャッシュにない (または無効になった) 回答を生成する
+
+        戻り値:
+            {"filter_shapes": 使用したフィルタ条件の組み合わせ, "questions": 質問数, "generated": 生成数, "cached": キャッシュ済み数, "empty": 検索結果なし, "errors": 失敗数}
+        """
+        with self.run_lock:
+            started = time.perf_counter()
+            shapes = self.filter_shapes()
+            questions = build_questions(self.medium_categories, self._combinations(), shapes)
+            stats = {"filter_shapes": [list(shape) for shape in shapes], "questions": len(questions), "generated": 0, "cached": 0, "empty": 0, "errors": 0, "stopped": 0}
+            if questions:
+                self._embed(questions)
+                with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="prewarm") as executor:
+                    for outcome in executor.map(self._answer, questions):
+                        stats[outcome] += 1
+            stats["seconds"] = round(time.perf_counter() - started, 1)
+            self.last_stats = stats
+            print(f"Prewarm finished: {stats}")
+            return stats
+
+    def _loop(self):
+        while not self.stop_event.is_set():
+            if in_window(datetime.datetime.now().hour, self.window):
+                try:
+                    self.run_once()
+                except Exception as e:
+                    print(f"Error in prewarm job: {e}")
+            self.stop_event.wait(self.interval_seconds)
+
+    def start(self):
+        """時間帯内で定期的に実行するバックグラウンドスレッドを開始"""
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._loop, name="prewarm", daemon=True)
+        self.thread.start()
+        print(f"Prewarm job scheduled between {self.window[0]}:00 and {self.window[1]}:00")
+
+    def stop(self):
+        self.stop_event.set()
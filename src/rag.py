@@ -0,0 +1,132 @@
+import time
+from functools import lru_cache
+
+from langchain import hub
+from langchain_core.documents import Document
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnablePassthrough
+
+# カスタムRAGプロンプトテンプレートを定義
+# langchainhubに依存せずに自前でプロンプトを定義
+RAG_PROMPT_TEMPLATE = """あなたは不動産会社の営業担当です。取り扱っている物件を中心をしたエリアに対して、エリアの魅力や特徴、生活環境について詳しく説明することが得意です。以下の情報源を元に、質問に対して具体的で魅力的な回答を提供してください。
+
+情報源:
+{context}
+
+質問: {question}
+
+回答の際は以下のポイントを意識してください：
+1. エリアの魅力や特徴を具体的に伝える
+2. 実際に住むイメージが湧くような説明をする
+3. 交通、教育、商業施設、医療、公共施設などの生活利便性について触れる
+4. 数字やデータを用いて客観的な情報も提供する
+5. 物件の見学意欲が高まるような表現を使う
+6. 情報源に記載がない内容については「この点については情報がありません」と正直に伝える
+
+回答:"""
+
+
+@lru_cache(maxsize=1)
+def load_prompt():
+    """RAG用のプロンプトを取得 (質問ごとにhubへ問い合わせないよう1度だけ読み込む)"""
+    try:
+        # まずhub.pullを試す（langchainhubがインストールされている場合）
+        prompt = hub.pull("rlm/rag-prompt")
+        print("Successfully pulled prompt from langchain hub")
+    except (ImportError, Exception) as e:
+        # 失敗した場合は自前のプロンプトを使用
+        print(f"Using custom prompt template due to: {e}")
+        prompt = ChatPromptTemplate.from_template(RAG_PROMPT_TEMPLATE)
+    return prompt
+
+
+def format_docs(docs):
+    return "\n\n".join(doc.page_content for doc in docs)
+
+
+def answer_question(
+    vector_store,
+    llm,
+    query_text,
+    filter_conditions=None,
+    answer_cache=None,
+    n_results=5,
+    query_embedding=None,
+    timings=None,
+    prewarm=False,
+):
+    """
+    検索と回答生成を行う (Streamlitに依存しない)
+
+    引数:
+        vector_store: VectorStoreのインスタンス
+        llm: 回答生成に使うチャットモデル
+        query_text: 質問
+        filter_conditions: メタデータによるフィルタリング条件
+        answer_cache: 回答キャッシュ (省略時はキャッシュしない)
+        n_results: 検索するチャンク数
+        query_embedding: 生成済みの質問の埋め込み (省略時は生成する)
+        timings: 辞書を渡すと段階ごとの処理時間 (秒) を "embed" / "search" / "generate" に記録する
+        prewarm: 事前生成ジョブからの呼び出しか (ヒット率の集計に含めず、保存する回答に印を付ける)
+    戻り値:
+        {"answer": 回答 (検索結果がない場合はNone), "docs": 検索されたDocumentのリスト,
+         "chunk_ids": チャンクIDのリスト, "cached": キャッシュから返したかどうか}
+    """
+    timings = {} if timings is None else timings
+
+    # 質問の埋め込みは検索と回答キャッシュの両方で使う
+    started = time.perf_counter()
+    if query_embedding is None:
+        query_embedding = vector_store.embeddings.embed_query(query_text)
+    timings["embed"] = time.perf_counter() - started
+
+    # 検索結果を取得（フィルタリング条件があれば適用）
+    started = time.perf_counter()
+    search_results = vector_store.search(
+        query_text,
+        n_results=n_results,
+        filter_conditions=filter_conditions,
+        query_embedding=query_embedding
+    )
+    timings["search"] = time.perf_counter() - started
+
+    # 検索結果がない場合
+    if not search_results or not search_results.get('documents', [[]])[0]:
+        return {"answer": None, "docs": [], "chunk_ids": [], "cached": False}
+
+    # 検索結果をドキュメント形式に変換
+    docs = []
+    for i, doc_text in enumerate(search_results['documents'][0]):
+        # メタデータの取得（利用可能な場合）
+        metadata = {}
+        if search_results.get('metadatas') and len(search_results['metadatas']) > 0:
+            metadata = search_results['metadatas'][0][i] if i < len(search_results['metadatas'][0]) else {}
+        docs.append(Document(page_content=doc_text, metadata=metadata or {}))
+
+    # 同じ条件・同じ内容のチャンクで類似した質問の回答があればそれを返す
+    chunk_ids = search_results['ids'][0]
+    chunk_texts = search_results['documents'][0]
+    if answer_cache is not None:
+        cached_answer = answer_cache.lookup(query_embedding, filter_conditions, chunk_ids, chunk_texts, record=not prewarm)
+        if cached_answer is not None:
+            return {"answer": cached_answer, "docs": docs, "chunk_ids": chunk_ids, "cached": True}
+
+    started = time.perf_counter()
+    qa_chain = (
+        {
+            "context": lambda x: format_docs(docs),
+            "question": RunnablePassthrough(),
+        }
+        | load_prompt()
+        | llm
+        | StrOutputParser()
+    )
+    answer = qa_chain.invoke(query_text)
+    timings["generate"] = time.perf_counter() - started
+
+    if answer_cache is not None and answer:
+        answer_cache.put(
+            query_text, query_embedding, filter_conditions, chunk_ids, chunk_texts, answer, prewarmed=prewarm
+        )
+    return {"answer": answer, "docs": docs, "chunk_ids": chunk_ids, "cached": False}
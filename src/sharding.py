@@ -0,0 +1,216 @@
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+# シャードを決めるメタデータのキー
+SHARD_KEY = "municipality"
+
+# get()/query() の結果に含まれうるキー
+_RESULT_KEYS = ["ids", "embeddings", "metadatas", "documents", "distances"]
+
+
+def shard_index(value, n_shards):
+    """値から安定したシャード番号を求める (プロセスをまたいでも同じ値になる)"""
+    return zlib.crc32(str(value).encode("utf-8")) % n_shards
+
+
+def _shard_key_from_where(where):
+    """where句からシャードキーの完全一致条件を取り出す (なければNone)"""
+    if not where:
+        return None
+    if "$and" in where:
+        for condition in where["$and"]:
+            value = _shard_key_from_where(condition)
+            if value is not None:
+                return value
+        return None
+    value = where.get(SHARD_KEY)
+    if isinstance(value, dict):
+        value = value.get("$eq")
+    return value if isinstance(value, str) and value else None
+
+
+class ShardedCollection:
+    """
+    複数のChromaDBコレクションにチャンクを分散して保持するコレクション
+
+    ChromaDBのCollectionと同じメソッド (upsert / get / delete / query / count) を持ち、
+    VectorStoreからは1つのコレクションとして扱える。
+    書き込みは市区町村名のハッシュ (市区町村がない場合はID) でシャードに振り分ける。
+    市区町村で絞り込んだ検索は該当するシャードだけを、それ以外は全シャードを並列に検索し、
+    距離の近い順に結果をマージする。
+    """
+
+    def __init__(self, client, name, n_shards, metadata=None):
+        self.name = name
+        self.shards = [
+            client.get_or_create_collection(name=f"{name}_shard{i:02d}", metadata=metadata)
+            for i in range(n_shards)
+        ]
+        self.executor = ThreadPoolExecutor(max_workers=n_shards, thread_name_prefix="shard")
+
+        # ID → シャード番号 (市区町村が変わったチャンクを元のシャードから消すために使う)
+        self.locations = {}
+        for shard, collection in enumerate(self.shards):
+            for doc_id in collection.get(include=[])["ids"]:
+                self.locations[doc_id] = shard
+        print(f"Using {n_shards} shards for collection '{name}'")
+
+    def _shard_for(self, doc_id, metadata):
+        value = (metadata or {}).get(SHARD_KEY) or doc_id
+        return shard_index(value, len(self.shards))
+
+    def _map(self, fn, shards=None):
+        """シャードごとの処理を並列に実行"""
+        return list(self.executor.map(fn, shards if shards is not None else self.shards))
+
+    def _group(self, ids, shard_of):
+        grouped = {}
+        for i, doc_id in enumerate(ids):
+            shard = shard_of(i, doc_id)
+            if shard is not None:
+                grouped.setdefault(shard, []).append(i)
+        return grouped
+
+    def upsert(self, ids, embeddings=None, metadatas=None, documents=None):
+        targets = [
+            self._shard_for(doc_id, metadatas[i] if metadatas else None)
+            for i, doc_id in enumerate(ids)
+        ]
+        routed = self._group(ids, lambda i, doc_id: targets[i])
+
+        # 以前は別のシャードにあったチャンク (市区町村が変わったもの) は元のシャードから削除する
+        moved = self._group(
+            ids,
+            lambda i, doc_id: None if self.locations.get(doc_id, targets[i]) == targets[i] else self.locations[doc_id]
+        )
+        for shard, indices in moved.items():
+            self.shards[shard].delete(ids=[ids[i] for i in indices])
+
+        def write(item):
+            shard, indices = item
+            self.shards[shard].upsert(
+                ids=[ids[i] for i in indices],
+                embeddings=[embeddings[i] for i in indices] if embeddings is not None else None,
+                metadatas=[metadatas[i] for i in indices] if metadatas else None,
+                documents=[documents[i] for i in indices] if documents is not None else None,
+            )
+
+        list(self.executor.map(write, routed.items()))
+        for doc_id, shard in zip(ids, targets):
+            self.locations[doc_id] = shard
+
+    def delete(self, ids=None, where=None):
+        if ids is None:
+            ids = self.get(where=where, include=[])["ids"]
+        grouped = self._group(ids, lambda i, doc_id: self.locations.get(doc_id))
+        for shard, indices in grouped.items():
+            self.shards[shard].delete(ids=[ids[i] for i in indices])
+        for doc_id in ids:
+            self.locations.pop(doc_id, None)
+
+    def count(self):
+        return sum(self._map(lambda collection: collection.count()))
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=["metadatas", "documents"]):
+        if where is None and ids is None and (limit is not None or offset):
+            # limit/offset はシャードを順に連結したものとして扱う
+            results = []
+            skip = offset or 0
+            remaining = limit
+            for collection in self.shards:
+                if remaining is not None and remaining <= 0:
+                    break
+                size = collection.count()
+                if skip >= size:
+                    skip -= size
+                    continue
+                result = collection.get(limit=remaining, offset=skip, include=include)
+                skip = 0
+                results.append(result)
+                if remaining is not None:
+                    remaining -= len(result["ids"])
+            return self._merge_get(results, include)
+
+        shards = self.shards
+        if ids is not None:
+            # IDの所在が分かっているシャードだけを読む
+            located = {self.locations[doc_id] for doc_id in ids if doc_id in self.locations}
+            shards = [self.shards[shard] for shard in sorted(located)]
+        else:
+            value = _shard_key_from_where(where)
+            if value is not None:
+                shards = [self.shards[shard_index(value, len(self.shards))]]
+        merged = self._merge_get(self._map(
+            lambda collection: collection.get(ids=ids, where=where, include=include),
+            shards
+        ), include)
+
+        if limit is not None or offset:
+            end = (offset or 0) + limit if limit is not None else None
+            for key in ("ids", "embeddings", "metadatas", "documents"):
+                if merged.get(key) is not None:
+                    merged[key] = merged[key][offset or 0:end]
+        return merged
+
+    def _merge_get(self, results, include):
+        merged = {"ids": []}
+        for key in ("embeddings", "metadatas", "documents"):
+            merged[key] = [] if key in include else None
+        for result in results:
+            merged["ids"].extend(result["ids"])
+            for key in ("embeddings", "metadatas", "documents"):
+                if merged[key] is not None and result.get(key) is not None:
+                    merged[key].extend(result[key])
+        return merged
+
+    def query(
+        self,
+        query_embeddings,
+        n_results=10,
+        where=None,
+        where_document=None,
+        include=["metadatas", "documents", "distances"],
+    ):
+        value = _shard_key_from_where(where)
+        if value is not None:
+            # 絞り込み条件でシャードが決まる場合はそのシャードだけを検索
+            return self.shards[shard_index(value, len(self.shards))].query(
+                query_embeddings=query_embeddings,
+                n_results=n_results,
+                where=where,
+                where_document=where_document,
+                include=include,
+            )
+
+        def search(collection):
+            if collection.count() == 0:
+                return None
+            return collection.query(
+                query_embeddings=query_embeddings,
+                n_results=n_results,
+                where=where,
+                where_document=where_document,
+                include=include,
+            )
+
+        results = [r for r in self._map(search) if r is not None]
+        return self._merge_query(results, len(query_embeddings), n_results)
+
+    def _merge_query(self, results, n_queries, n_results):
+        """各シャードの上位k件を距離の近い順にマージ"""
+        keys = [key for key in _RESULT_KEYS if results and results[0].get(key) is not None]
+        merged = {key: [] for key in _RESULT_KEYS}
+        for q in range(n_queries):
+            candidates = []
+            for result in results:
+                for rank in range(len(result["ids"][q])):
+                    candidates.append({key: result[key][q][rank] for key in keys})
+            candidates.sort(key=lambda c: c.get("distances", 0.0))
+            for key in _RESULT_KEYS:
+                if key in keys:
+                    merged[key].append([c[key] for c in candidates[:n_results]])
+                else:
+                    merged[key] = None
+        if not results:
+            merged = {key: [[] for _ in range(n_queries)] for key in _RESULT_KEYS}
+        return merged
@@ -0,0 +1,141 @@
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+# アップロードされたファイルの読み込みを試すエンコーディング
+ENCODINGS = ['utf-8', 'shift_jis', 'cp932', 'euc_jp', 'iso2022_jp']
+
+# 文（「。」で終わる）または行（改行で終わる）を1つの区切りとして切り出す
+_SEGMENT_PATTERN = re.compile(r"[^\n。]*(?:。|\n+)|[^\n。]+")
+
+# 長すぎる区切りをさらに分割するときに使う境界 (優先度順)
+_FALLBACK_SEPARATORS = [". ", ".", " "]
+
+
+def decode_text(file_bytes):
+    """
+    複数のエンコーディングを順に試してバイト列をデコードする
+
+    戻り値:
+        (テキスト, エンコーディング) のタプル。どれでも読めない場合は (None, None)
+    """
+    for encoding in ENCODINGS:
+        try:
+            return file_bytes.decode(encoding), encoding
+        except UnicodeDecodeError:
+            continue
+    return None, None
+
+
+class JapaneseTextSplitter:
+    """
+    「。」と改行を区切りとする日本語向けのテキスト分割
+
+    テキストを先頭から1回だけ走査し、各チャンクの開始位置 (start_index) を
+    再検索せずに求める。区切りの「。」や改行は前の文の末尾に含める。
+    """
+
+    def __init__(self, chunk_size=512, chunk_overlap=10):
+        if chunk_overlap >= chunk_size:
+            raise ValueError(f"chunk_overlap ({chunk_overlap}) must be smaller than chunk_size ({chunk_size})")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    def _segments(self, text):
+        """(開始位置, 終了位置) の区切りを順に返す。chunk_sizeを超える区切りはさらに分割する"""
+        for match in _SEGMENT_PATTERN.finditer(text):
+            start, end = match.span()
+            while end - start > self.chunk_size:
+                window_end = start + self.chunk_size
+                cut = -1
+                for separator in _FALLBACK_SEPARATORS:
+                    cut = text.rfind(separator, start, window_end)
+                    if cut > start:
+                        cut += len(separator)
+                        break
+                if cut <= start or cut > window_end:
+                    cut = window_end
+                yield start, cut
+                start = cut
+            if end > start:
+                yield start, end
+
+    def _emit(self, text, start, end):
+        """前後の空白を除いたチャンクと、その開始位置を返す"""
+        chunk = text[start:end]
+        stripped = chunk.lstrip()
+        start += len(chunk) - len(stripped)
+        return start, stripped.rstrip()
+
+    def iter_chunks(self, text):
+        """
+        テキストを分割し、(start_index, チャンク) を順に返すジェネレータ
+
+        引数:
+            text: 分割するテキスト
+        """
+        # 現在のチャンクに含まれる区切り (重複分を求めるために保持)
+        window = []
+        for segment in self._segments(text):
+            if window and segment[1] - window[0][0] > self.chunk_size:
+                start, chunk = self._emit(text, window[0][0], window[-1][1])
+                if chunk:
+                    yield start, chunk
+
+                # chunk_overlap に収まる末尾の区切りを次のチャンクに引き継ぐ
+                carried = []
+                for previous in reversed(window):
+                    if segment[1] - previous[0] > self.chunk_size:
+                        break
+                    if window[-1][1] - previous[0] > self.chunk_overlap:
+                        break
+                    carried.insert(0, previous)
+                window = carried
+            window.append(segment)
+
+        if window:
+            start, chunk = self._emit(text, window[0][0], window[-1][1])
+            if chunk:
+                yield start, chunk
+
+    def split_text(self, text):
+        """テキストをチャンクのリストに分割"""
+        return [chunk for _, chunk in self.iter_chunks(text)]
+
+    def split_documents(self, documents):
+        """Documentを分割し、メタデータに start_index を付けたDocumentのリストを返す"""
+        from langchain_core.documents import Document
+
+        chunks = []
+        for document in documents:
+            for start, chunk in self.iter_chunks(document.page_content):
+                metadata = dict(document.metadata)
+                metadata['start_index'] = start
+                chunks.append(Document(page_content=chunk, metadata=metadata))
+        return chunks
+
+
+def _split_file(args):
+    path, chunk_size, chunk_overlap = args
+    with open(path, "rb") as f:
+        text, _ = decode_text(f.read())
+    if text is None:
+        raise ValueError(f"Could not detect the encoding of '{path}'")
+    splitter = JapaneseTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return path, list(splitter.iter_chunks(text))
+
+
+def split_files(paths, chunk_size=512, chunk_overlap=10, max_workers=None):
+    """
+    複数のファイルをプロセスプールで並列に分割する
+
+    引数:
+        paths: ファイルパスのリスト
+        chunk_size: チャンクの最大文字数
+        chunk_overlap: チャンク間で重複させる最大文字数
+        max_workers: ワーカープロセス数 (省略時はCPU数)
+    戻り値:
+        {ファイルパス: [(start_index, チャンク), ...]} の辞書
+    """
+    tasks = [(path, chunk_size, chunk_overlap) for path in paths]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return dict(executor.map(_split_file, tasks))
@@ -3,6 +3,8 @@ from dotenv import load_dotenv
 import sys
 import sqlite3
 import tempfile
+import json
+import time
 
 # 環境変数のロード
 load_dotenv()
@@ -12,15 +14,75 @@ print(f"Using SQLite version: {sqlite3.sqlite_version}")
 
 # chromadbのインポート
 import chromadb
+import numpy as np
 from langchain_openai import OpenAIEmbeddings
 
+from src.dedup import DEFAULT_DEDUP_POLICY, Deduplicator
+from src.ingest import AdaptiveBatchScheduler, content_hash
+
 # 固定のコレクション名
 COLLECTION_NAME = "ask_the_doc_collection"
 
+# スナップショットの一括読み書き時のバッチサイズ
+SNAPSHOT_BATCH_SIZE = 5000
+
+
+def shards_from_env():
+    """環境変数 VECTOR_STORE_SHARDS からシャード数を読み込む (2以上で市区町村ごとに複数のコレクションへ分散する)"""
+    value = os.getenv("VECTOR_STORE_SHARDS") or "1"
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"VECTOR_STORE_SHARDS must be an integer, got '{value}'")
+
+
+# HNSWインデックスのパラメータ (未設定のものはChromaDBの既定値:
+# construction_ef=100, search_ef=10, M=16)
+HNSW_PARAMS = ["construction_ef", "search_ef", "M"]
+
+
+def hnsw_params_from_env():
+    """環境変数 HNSW_M / HNSW_CONSTRUCTION_EF / HNSW_SEARCH_EF からHNSWのパラメータを読み込む"""
+    params = {}
+    for name in HNSW_PARAMS:
+        env_name = f"HNSW_{name.upper()}"
+        value = os.getenv(env_name)
+        if not value:
+            continue
+        try:
+            params[name] = int(value)
+        except ValueError:
+            raise ValueError(f"{env_name} must be an integer, got '{value}'")
+    return params
+
+
+def hnsw_metadata(hnsw_params=None):
+    """HNSWのパラメータからコレクションのメタデータを作成"""
+    metadata = {"hnsw:space": "cosine"}
+    for name, value in (hnsw_params or {}).items():
+        if name not in HNSW_PARAMS:
+            raise ValueError(f"Unknown HNSW parameter: {name}")
+        metadata[f"hnsw:{name}"] = int(value)
+    return metadata
+
+
 class VectorStore:
-    def __init__(self):
-        """ChromaDBのベクトルストアを初期化"""
+    def __init__(self, shards=None, hnsw_params=None, dedup_policy=DEFAULT_DEDUP_POLICY):
+        """
+        ChromaDBのベクトルストアを初期化
+
+        引数:
+            shards: コレクションのシャード数 (1の場合は単一のコレクション、省略時は環境変数から読み込む)
+            hnsw_params: HNSWインデックスのパラメータ {"construction_ef": 200, "search_ef": 100, "M": 16}
+                (コレクション作成時にのみ反映される。省略時は環境変数から読み込む)
+            dedup_policy: 重複チャンクの扱い ("skip" / "link" / "keep"、"off"で検出しない)
+        """
         try:
+            if shards is None:
+                shards = shards_from_env()
+            self.hnsw_params = dict(hnsw_params_from_env() if hnsw_params is None else hnsw_params)
+            collection_metadata = hnsw_metadata(self.hnsw_params)
+
             # インメモリモードでクライアントを初期化
             self.client = chromadb.Client(
                 settings=chromadb.Settings(
@@ -31,18 +93,51 @@ class VectorStore:
             )
             
             # コレクションの作成または取得
-            try:
-                self.collection = self.client.get_collection(name=COLLECTION_NAME)
-                print(f"Collection '{COLLECTION_NAME}' already exists")
-            except Exception:
-                print(f"Creating new collection '{COLLECTION_NAME}'")
-                self.collection = self.client.create_collection(
-                    name=COLLECTION_NAME,
-                    metadata={"hnsw:space": "cosine"}
+            if shards > 1:
+                from src.sharding import ShardedCollection
+                self.collection = ShardedCollection(
+                    self.client,
+                    COLLECTION_NAME,
+                    shards,
+                    metadata=collection_metadata
                 )
+            else:
+                try:
+                    self.collection = self.client.get_collection(name=COLLECTION_NAME)
+                    print(f"Collection '{COLLECTION_NAME}' already exists")
+                    if (self.collection.metadata or {}) != collection_metadata:
+                        print(f"Warning: existing collection uses {self.collection.metadata}, requested {collection_metadata}")
+                except Exception:
+                    print(f"Creating new collection '{COLLECTION_NAME}'")
+                    self.collection = self.client.create_collection(
+                        name=COLLECTION_NAME,
+                        metadata=collection_metadata
+                    )
                 
-            # 埋め込みモデルの設定
-            self.embeddings = OpenAIEmbeddings()
+            # 埋め込みモデルの設定 (検索時の質問の埋め込みなどはクライアントの再試行に任せる)
+            self.embeddings = OpenAIEmbeddings(base_url=os.getenv("OPENAI_BASE_URL"))
+            # 取り込み時のバッチはスケジューラ側でバックオフするため、再試行しないクライアントを使う
+            self.batch_embeddings = OpenAIEmbeddings(max_retries=0, base_url=os.getenv("OPENAI_BASE_URL"))
+            self.scheduler = AdaptiveBatchScheduler()
+
+            # チャンクの削除時に呼び出されるコールバック
+            self.change_listeners = []
+
+            # メタデータ集計用のDuckDBテーブル (duckdbが使えない場合は無効)
+            try:
+                from src.analytics import CorpusAnalytics
+                self.analytics = CorpusAnalytics()
+                self.analytics.rebuild(self._iter_collection(include=["metadatas"]))
+            except Exception as e:
+                print(f"Corpus analytics disabled: {e}")
+                self.analytics = None
+
+            # 取り込み時の重複検出 (DEDUP_POLICY=off で無効)
+            if dedup_policy == "off":
+                self.deduplicator = None
+            else:
+                self.deduplicator = Deduplicator(policy=dedup_policy)
+                self.deduplicator.rebuild(self._iter_collection(include=["documents"]))
             print("VectorStore initialization completed successfully")
             
         except Exception as e:
@@ -62,6 +157,8 @@ class VectorStore:
             metadatas=metadatas,
             ids=ids
         )
+        if self.analytics is not None:
+            self.analytics.upsert(ids, metadatas)
         print(f"Added {len(texts)} documents to collection")
 
     def update_documents(self, documents):
@@ -77,10 +174,20 @@ class VectorStore:
             metadatas=metadatas,
             ids=ids
         )
+        if self.analytics is not None:
+            self.analytics.upsert(ids, metadatas)
         print(f"Updated {len(texts)} documents in collection")
 
-    def upsert_documents(self, documents, ids=None):
-        """ドキュメントを追加または更新"""
+    def upsert_documents(self, documents, ids=None, journal=None, job_id=None):
+        """
+        ドキュメントを追加または更新
+
+        引数:
+            documents: Documentオブジェクトまたはテキストのリスト
+            ids: ドキュメントIDのリスト
+            journal: 取り込みジャーナル (指定すると中断したジョブを途中から再開できる)
+            job_id: ジャーナル上のジョブID
+        """
         try:
             if self.collection is None:
                 print("Collection is not available")
@@ -99,27 +206,73 @@ class VectorStore:
             # IDsの生成または使用
             if ids is None:
                 ids = [f"doc_{i}" for i in range(len(documents))]
-            
-            # 埋め込みベクトルの生成
-            print(f"Generating embeddings for {len(texts)} documents...")
+
+            # ジャーナルで完了済み、かつコレクションに実在するチャンクは飛ばす
+            hashes = [content_hash(text, metadata) for text, metadata in zip(texts, metadatas)]
+            pending = list(range(len(texts)))
+            if journal is not None and job_id is not None:
+                completed = journal.completed(job_id)
+                done = [i for i in pending if completed.get(ids[i]) == hashes[i]]
+                if done:
+                    present = set(self._existing_ids([ids[i] for i in done]))
+                    done = {i for i in done if ids[i] in present}
+                    pending = [i for i in pending if i not in done]
+                    print(f"Resuming job '{job_id}': skipping {len(done)} already ingested chunks")
+
+            # 埋め込みを生成する前に重複チャンクを検出する
+            report = {
+                "total": len(pending), "duplicates": 0, "skipped": 0, "linked": 0, "removed": 0, "embeddings_saved": 0
+            }
+            links = {}
+            stale_ids = []
+            if self.deduplicator is not None and pending:
+                duplicates = self.deduplicator.plan([ids[i] for i in pending], [texts[i] for i in pending])
+                duplicates = self._confirm_duplicates(duplicates, {ids[i] for i in pending})
+                report["duplicates"] = len(duplicates)
+                if self.deduplicator.policy != "keep":
+                    duplicates = {pending[j]: canonical_id for j, canonical_id in duplicates.items()}
+                    pending = [i for i in pending if i not in duplicates]
+                    if self.deduplicator.policy == "link":
+                        links = duplicates
+                    else:
+                        report["skipped"] = len(duplicates)
+                        # 既存のIDが重複する内容で上書きされる場合、古い内容を残さないように削除する
+                        stale_ids = self._existing_ids([ids[i] for i in duplicates])
+
+            pending_texts = [texts[i] for i in pending]
+
+            def write_batch(start, end, embeddings):
+                batch = pending[start:end]
+                batch_ids = [ids[i] for i in batch]
+                self._upsert_batch(
+                    ids=batch_ids,
+                    texts=[texts[i] for i in batch],
+                    metadatas=[metadatas[i] for i in batch],
+                    embeddings=embeddings
+                )
+                if journal is not None and job_id is not None:
+                    journal.mark_done(job_id, batch_ids, [hashes[i] for i in batch])
+                print(f"Upserted {end}/{len(pending)} pending documents")
+
+            # 埋め込みベクトルの生成 (トークン数に応じたバッチ・レート制限時のバックオフ付き)
+            print(f"Generating embeddings for {len(pending_texts)} documents...")
             try:
-                embeddings = self.embeddings.embed_documents(texts)
-                if not embeddings or len(embeddings) != len(texts):
-                    print(f"Warning: Generated {len(embeddings) if embeddings else 0} embeddings for {len(texts)} texts")
-                    
-                # ドキュメントごとに処理して確実に追加
-                for i, (text, metadata, doc_id, embedding) in enumerate(zip(texts, metadatas, ids, embeddings)):
-                    try:
-                        self.collection.upsert(
-                            embeddings=[embedding],
-                            documents=[text],
-                            metadatas=[metadata],
-                            ids=[doc_id]
-                        )
-                    except Exception as e:
-                        print(f"Error upserting document {i} (ID: {doc_id}): {e}")
-                
+                self.scheduler.run(pending_texts, self.batch_embeddings.embed_documents, write_batch)
+                if links:
+                    report["linked"] = self._write_links(links, ids, texts, metadatas)
+                    if journal is not None and job_id is not None:
+                        journal.mark_done(job_id, [ids[i] for i in links], [hashes[i] for i in links])
+                if stale_ids:
+                    self.delete_documents(stale_ids)
+                    report["removed"] = len(stale_ids)
+                if journal is not None and job_id is not None:
+                    journal.finish(job_id)
+                report["embeddings_saved"] = report["skipped"] + report["linked"]
+                if self.deduplicator is not None:
+                    print(f"Dedup ({self.deduplicator.policy}): {report['duplicates']} duplicates, "
+                          f"{report['embeddings_saved']} embeddings saved, {report['removed']} stale chunks removed")
                 print(f"Successfully upserted {len(texts)} documents to collection '{COLLECTION_NAME}'")
+                return report
             except Exception as e:
                 print(f"Error generating embeddings: {e}")
                 raise
@@ -127,6 +280,75 @@ class VectorStore:
             print(f"Error in upsert_documents: {e}")
             raise
 
+    def _confirm_duplicates(self, duplicates, batch_ids):
+        """
+        重複元がこのバッチで書き込まれるか、コレクションに実在する重複だけを残す
+
+        インデックスとコレクションがずれていた場合に、存在しないチャンクの重複として
+        内容を捨ててしまわないようにする。
+        """
+        stored = {canonical_id for canonical_id in duplicates.values() if canonical_id not in batch_ids}
+        if not stored:
+            return duplicates
+        present = set(self._existing_ids(sorted(stored)))
+        missing = stored - present
+        if missing:
+            # コレクションにないチャンクはインデックスからも外す
+            self.deduplicator.remove(missing)
+            print(f"Dedup: {len(missing)} indexed chunks are missing from the collection")
+        return {
+            i: canonical_id for i, canonical_id in duplicates.items()
+            if canonical_id in batch_ids or canonical_id in present
+        }
+
+    def _write_links(self, links, ids, texts, metadatas):
+        """
+        重複チャンクを既存チャンクの埋め込みを再利用して書き込む
+
+        引数:
+            links: {チャンクの位置: 重複元のチャンクID} の辞書
+        戻り値:
+            埋め込みを再利用できたチャンク数
+        """
+        canonical = self.collection.get(ids=sorted(set(links.values())), include=["embeddings"])
+        embeddings = dict(zip(canonical['ids'], canonical['embeddings'] or []))
+        linked = [i for i in links if links[i] in embeddings]
+        missing = [i for i in links if links[i] not in embeddings]
+        if linked:
+            self._upsert_batch(
+                ids=[ids[i] for i in linked],
+                texts=[texts[i] for i in linked],
+                metadatas=[{**metadatas[i], "duplicate_of": links[i]} for i in linked],
+                embeddings=[embeddings[links[i]] for i in linked]
+            )
+        if missing:
+            # 重複元が書き込まれていない場合は通常どおり埋め込みを生成する
+            def write_missing(start, end, batch_embeddings):
+                batch = missing[start:end]
+                self._upsert_batch(
+                    ids=[ids[i] for i in batch],
+                    texts=[texts[i] for i in batch],
+                    metadatas=[metadatas[i] for i in batch],
+                    embeddings=batch_embeddings
+                )
+            self.scheduler.run([texts[i] for i in missing], self.batch_embeddings.embed_documents, write_missing)
+        return len(linked)
+
+    def add_change_listener(self, listener):
+        """チャンクが削除されたときに削除されたIDのリストを受け取るコールバックを登録"""
+        self.change_listeners.append(listener)
+
+    def _notify_change(self, ids):
+        for listener in self.change_listeners:
+            try:
+                listener(ids)
+            except Exception as e:
+                print(f"Error in change listener: {e}")
+
+    def _existing_ids(self, ids):
+        """指定したIDのうちコレクションに存在するもの"""
+        return self.collection.get(ids=ids, include=[]).get('ids', [])
+
     def delete_documents(self, ids):
         """ドキュメントを削除"""
         try:
@@ -135,6 +357,11 @@ class VectorStore:
                 return
                 
             self.collection.delete(ids=ids)
+            if self.analytics is not None:
+                self.analytics.delete(ids)
+            if self.deduplicator is not None:
+                self.deduplicator.remove(ids)
+            self._notify_change(ids)
             print(f"Deleted {len(ids)} documents from collection")
         except Exception as e:
             print(f"Error deleting documents: {e}")
@@ -160,7 +387,7 @@ class VectorStore:
             print(f"Error getting documents: {e}")
             return {"ids": [], "documents": [], "metadatas": []}
 
-    def search(self, query, n_results=5, filter_conditions=None):
+    def search(self, query, n_results=5, filter_conditions=None, query_embedding=None):
         """
         クエリに基づいてドキュメントを検索
         
@@ -168,10 +395,12 @@ class VectorStore:
             query: 検索クエリ
             n_results: 返す結果の数
             filter_conditions: メタデータによるフィルタリング条件の辞書 {"field": "value"}
+            query_embedding: 生成済みのクエリの埋め込み (省略時は生成する)
         """
         try:
             # クエリの埋め込みを生成
-            query_embedding = self.embeddings.embed_query(query)
+            if query_embedding is None:
+                query_embedding = self.embeddings.embed_query(query)
             
             # フィルタリング条件を作成（指定されている場合）
             where = None
@@ -186,6 +415,12 @@ class VectorStore:
                     # ChromaDBの制限により完全一致になる
                     if key and value:
                         where[key] = value
+
+                # 複数の条件は$andで結合する必要がある
+                if len(where) > 1:
+                    where = {"$and": [{key: value} for key, value in where.items()]}
+                elif not where:
+                    where = None
                 
                 print(f"Applying filter conditions: {where}")
             
@@ -213,4 +448,142 @@ class VectorStore:
             return count
         except Exception as e:
             print(f"Error counting documents: {e}")
-            return 0 
\ No newline at end of file
+            return 0
+
+    def _upsert_batch(self, ids, texts, metadatas, embeddings):
+        """埋め込み済みのチャンクをまとめてコレクションに書き込む"""
+        # ChromaDBは空のメタデータを受け付けないため、メタデータの有無で分けて書き込む
+        for has_metadata in (True, False):
+            part = [i for i, metadata in enumerate(metadatas) if bool(metadata) == has_metadata]
+            if not part:
+                continue
+            self.collection.upsert(
+                embeddings=[embeddings[i] for i in part],
+                documents=[texts[i] for i in part],
+                metadatas=[metadatas[i] for i in part] if has_metadata else None,
+                ids=[ids[i] for i in part]
+            )
+        if self.analytics is not None:
+            self.analytics.upsert(ids, metadatas)
+        if self.deduplicator is not None:
+            self.deduplicator.add(ids, texts)
+
+    def _iter_collection(self, batch_size=SNAPSHOT_BATCH_SIZE, include=("documents", "metadatas", "embeddings")):
+        """
+        コレクションの内容をバッチごとに取得
+
+        引数:
+            batch_size: 一度にコレクションから読み出す件数
+            include: 取得する項目 (埋め込みが不要な場合は省くとベクトルを読み出さずに済む)
+        """
+        offset = 0
+        while True:
+            batch = self.collection.get(
+                limit=batch_size,
+                offset=offset,
+                include=list(include)
+            )
+            if not batch.get('ids'):
+                break
+            yield batch
+            offset += len(batch['ids'])
+
+    def export_snapshot(self, path, batch_size=SNAPSHOT_BATCH_SIZE):
+        """
+        コレクションをParquet/Arrowファイルに書き出す
+
+        引数:
+            path: 出力先 (.arrow/.feather ならArrow IPC、それ以外はParquet)
+            batch_size: 一度にコレクションから読み出す件数
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        use_ipc = os.path.splitext(path)[1].lower() in (".arrow", ".feather")
+        writer = None
+        total = 0
+        try:
+            for batch in self._iter_collection(batch_size):
+                embeddings = batch['embeddings']
+                dim = len(embeddings[0])
+                if writer is None:
+                    schema = pa.schema(
+                        [
+                            ("id", pa.string()),
+                            ("document", pa.string()),
+                            ("metadata", pa.string()),
+                            ("embedding", pa.list_(pa.float32(), dim)),
+                        ],
+                        metadata={
+                            "collection": COLLECTION_NAME,
+                            "dimension": str(dim),
+                            **{k: str(v) for k, v in hnsw_metadata(self.hnsw_params).items()},
+                        }
+                    )
+                    if use_ipc:
+                        writer = pa.ipc.new_file(path, schema)
+                    else:
+                        writer = pq.ParquetWriter(path, schema)
+
+                flat = pa.array(np.asarray(embeddings, dtype=np.float32).ravel())
+                record_batch = pa.record_batch(
+                    [
+                        pa.array(batch['ids'], type=pa.string()),
+                        pa.array(batch['documents'], type=pa.string()),
+                        pa.array(
+                            [json.dumps(m or {}, ensure_ascii=False) for m in batch['metadatas']],
+                            type=pa.string()
+                        ),
+                        pa.FixedSizeListArray.from_arrays(flat, dim),
+                    ],
+                    schema=schema
+                )
+                writer.write_batch(record_batch)
+                total += record_batch.num_rows
+        finally:
+            if writer is not None:
+                writer.close()
+
+        print(f"Exported {total} documents to snapshot '{path}'")
+        return total
+
+    def restore_snapshot(self, path, batch_size=SNAPSHOT_BATCH_SIZE):
+        """
+        export_snapshotで書き出したファイルをメモリマップして一括登録する
+        埋め込みはファイルのものをそのまま使用し、APIは呼び出さない
+
+        引数:
+            path: スナップショットファイルのパス
+            batch_size: 一度にコレクションへ書き込む件数
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        start = time.perf_counter()
+        total = 0
+        source = pa.memory_map(path, "r")
+        try:
+            if os.path.splitext(path)[1].lower() in (".arrow", ".feather"):
+                # Arrow IPCはメモリマップ上のバッファをコピーせずに参照できる
+                table = pa.ipc.open_file(source).read_all()
+                batches = table.to_batches(max_chunksize=batch_size)
+            else:
+                batches = pq.ParquetFile(source).iter_batches(batch_size=batch_size)
+
+            for record_batch in batches:
+                embedding_column = record_batch.column("embedding")
+                dim = embedding_column.type.list_size
+                vectors = embedding_column.flatten().to_numpy(zero_copy_only=False).reshape(-1, dim)
+                ids = record_batch.column("id").to_pylist()
+                self._upsert_batch(
+                    ids=ids,
+                    texts=record_batch.column("document").to_pylist(),
+                    metadatas=[json.loads(m) for m in record_batch.column("metadata").to_pylist()],
+                    embeddings=vectors.tolist()
+                )
+                total += len(ids)
+        finally:
+            source.close()
+
+        print(f"Restored {total} documents from snapshot '{path}' in {time.perf_counter() - start:.2f}s")
+        return total